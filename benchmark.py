@@ -0,0 +1,309 @@
+# python benchmark.py [--scale 4] [--repeat 5] [--json results.json] [--baseline old.json] [--folded out.folded] [files...]
+#
+# Without files, a synthetic corpus (Item, Mesh, Shape, Prefab and Map) is generated with the nice api.
+# Times are the best of --repeat runs, peak memory is measured in a separate run with tracemalloc.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+from construct import GreedyBytes, ListContainer
+
+import src.mini_lzo
+from src.gbx_structs import GbxStruct, GbxStructWithoutBodyParsed, CompressedLZ0, LZO_FAST, lzo
+from src.nice.api import AdvancedItem, Gate, Loc, Mesh, MeshFile, MapFile, PrefabFile, ShapeFile
+from src.parser import generate_file
+from src.profiler import Profiler
+from export_obj import export_obj, extract_solid2model
+from export_glb import export_glb_meshes
+
+AUTHOR = "benchmark"
+
+
+def grid_mesh(size):
+    """size x size quads on the ground, returns positions, normals, uvs and faces"""
+    xs, zs = np.meshgrid(np.arange(size + 1, dtype=np.float64), np.arange(size + 1, dtype=np.float64))
+    positions = np.stack([xs.ravel(), np.sin(xs.ravel() + zs.ravel()), zs.ravel()], axis=1)
+    normals = np.tile([0.0, 1.0, 0.0], (len(positions), 1))
+    uvs = positions[:, [0, 2]] / size
+
+    quads = np.arange(size * (size + 1)).reshape(size, size + 1)[:, :-1].ravel()
+    faces = np.concatenate(
+        [
+            np.stack([quads, quads + size + 1, quads + 1], axis=1),
+            np.stack([quads + 1, quads + size + 1, quads + size + 2], axis=1),
+        ]
+    )
+    return positions, normals, uvs, faces
+
+
+def generate_corpus(folder, scale=1):
+    """Writes a small and a large file of each kind, returns their paths"""
+    os.makedirs(folder, exist_ok=True)
+    file_paths = []
+
+    def write(file_name, builder):
+        file_path = os.path.join(folder, file_name)
+        with open(file_path, "wb") as f:
+            f.write(builder.generate())
+        file_paths.append(file_path)
+        return file_path
+
+    for label, size in (("Small", 4), ("Large", 16 * scale)):
+        positions, normals, uvs, faces = grid_mesh(size)
+
+        shape_path = write(f"{label}.Shape.Gbx", ShapeFile(AUTHOR, label, positions, faces))
+        mesh_path = write(
+            f"{label}.Mesh.Gbx",
+            MeshFile(
+                AUTHOR,
+                label,
+                [(positions, normals, uvs, faces, "RoadTech"), (positions + 1, normals, uvs, faces, "PlatformTech")],
+            ),
+        )
+
+        loc = Loc((0, 0, 0), (1, 0, 0, 0))
+        write(
+            f"{label}.Item.Gbx",
+            AdvancedItem(
+                author=AUTHOR,
+                name=label,
+                entities=[Mesh(loc, mesh_path), Gate(loc, shape_path, gameplayId="Turbo")],
+            ),
+        )
+        write(
+            f"{label}.Prefab.Gbx",
+            PrefabFile(AUTHOR, label, [Mesh(Loc((i * 8, 0, 0), (1, 0, 0, 0)), mesh_path) for i in range(4)]),
+        )
+
+        count = size * size
+        write(
+            f"{label}.Map.Gbx",
+            MapFile(
+                AUTHOR,
+                label,
+                blocks=[(f"RoadTechStraight{i % 8}", (i % 48, 9 + i // 2304, (i // 48) % 48)) for i in range(count)],
+                items=[
+                    (f"Item{i % 16}.Item.Gbx", ((i % 48) * 32.0, 80.0 + i // 2304 * 8.0, (i // 48) % 48 * 32.0))
+                    for i in range(count)
+                ],
+            ),
+        )
+
+    return file_paths
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        res = func()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def parse_bytes(raw_bytes, file_path, profiler=None):
+    nodes = ListContainer()
+    data = GbxStruct.parse(raw_bytes, gbx_data={}, nodes=nodes, filename=file_path, profiler=profiler)
+    data.nodes = nodes
+    return data
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_file(file_path, repeat, export_dir):
+    with open(file_path, "rb") as f:
+        raw_bytes = f.read()
+
+    parse_time, data = best_time(lambda: parse_bytes(raw_bytes, file_path), repeat)
+    build_time, new_bytes = best_time(lambda: generate_file(data), repeat)
+
+    res = {
+        "file": file_path,
+        "class_id": hex(data.classId),
+        "size": len(raw_bytes),
+        "parse_time": parse_time,
+        "build_time": build_time,
+        "round_trip": new_bytes == raw_bytes,
+        "parse_peak_memory": peak_memory(lambda: parse_bytes(raw_bytes, file_path)),
+    }
+
+    if data.bodyCompression == "compressed":
+        body = GbxStructWithoutBodyParsed.parse(raw_bytes, gbx_data={}, nodes=ListContainer()).body
+        lzo_body = CompressedLZ0(GreedyBytes)
+        res["body_size"] = len(body)
+        res["lzo_compress_time"], compressed = best_time(lambda: lzo_body.build(body), repeat)
+        res["lzo_fast_compress_time"], _ = best_time(lambda: lzo_body.build(body, compression=LZO_FAST), repeat)
+        res["lzo_decompress_time"], _ = best_time(lambda: lzo_body.parse(compressed), repeat)
+        if lzo is not None:
+            # the pure python fallback, to compare with python-lzo
+            compressed_body = compressed[8:]
+            res["mini_lzo_decompress_time"], _ = best_time(
+                lambda: src.mini_lzo.decompress(compressed_body, len(body)), repeat
+            )
+
+    if data.classId == 0x090BB000:
+
+        def export():
+            for i, mesh in enumerate(extract_solid2model(data, data)):
+                export_obj(os.path.join(export_dir, f"mesh{i}.obj"), *mesh)
+
+        res["export_obj_time"], _ = best_time(export, repeat)
+        res["export_glb_time"], _ = best_time(
+            lambda: export_glb_meshes(os.path.join(export_dir, "mesh.glb"), extract_solid2model(data, data)), repeat
+        )
+
+    return res
+
+
+def bench_chunks(file_paths, profiler):
+    """One profiled parse and build of each file, then a parse with memory tracing"""
+    memory_profiler = Profiler(trace_memory=True)
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            raw_bytes = f.read()
+        generate_file(parse_bytes(raw_bytes, file_path, profiler), profiler=profiler)
+        with memory_profiler:
+            parse_bytes(raw_bytes, file_path, memory_profiler)
+
+    # tracing slows everything down, times are only taken from the untraced run
+    chunks = {}
+    for chunkId, chunk_stats in profiler.stats["chunk"].items():
+        chunks[hex(chunkId)] = dict(chunk_stats, peak_memory=memory_profiler.stats["chunk"][chunkId]["peak_memory"])
+    return chunks
+
+
+def mb_per_s(size, elapsed):
+    return size / 1024**2 / elapsed if elapsed else float("inf")
+
+
+def summarize(files):
+    """Throughput per class id"""
+    by_class = defaultdict(list)
+    for res in files:
+        by_class[res["class_id"]].append(res)
+
+    summary = {}
+    for class_id, results in by_class.items():
+        size = sum(res["size"] for res in results)
+        parse_time = sum(res["parse_time"] for res in results)
+        build_time = sum(res["build_time"] for res in results)
+        summary[class_id] = {
+            "files": len(results),
+            "size": size,
+            "parse_mb_s": mb_per_s(size, parse_time),
+            "parse_files_s": len(results) / parse_time,
+            "build_mb_s": mb_per_s(size, build_time),
+            "build_files_s": len(results) / build_time,
+            "round_trip": all(res["round_trip"] for res in results),
+            "parse_peak_memory": max(res["parse_peak_memory"] for res in results),
+        }
+        if any("body_size" in res for res in results):
+            body_size = sum(res.get("body_size", 0) for res in results)
+            compress_time = sum(res.get("lzo_compress_time", 0) for res in results)
+            decompress_time = sum(res.get("lzo_decompress_time", 0) for res in results)
+            fast_compress_time = sum(res.get("lzo_fast_compress_time", 0) for res in results)
+            summary[class_id]["lzo_compress_mb_s"] = mb_per_s(body_size, compress_time)
+            summary[class_id]["lzo_fast_compress_mb_s"] = mb_per_s(body_size, fast_compress_time)
+            summary[class_id]["lzo_decompress_mb_s"] = mb_per_s(body_size, decompress_time)
+        if any("mini_lzo_decompress_time" in res for res in results):
+            body_size = sum(res.get("body_size", 0) for res in results if "mini_lzo_decompress_time" in res)
+            decompress_time = sum(res.get("mini_lzo_decompress_time", 0) for res in results)
+            summary[class_id]["mini_lzo_decompress_mb_s"] = mb_per_s(body_size, decompress_time)
+        if any("export_obj_time" in res for res in results):
+            summary[class_id]["export_obj_files_s"] = len(results) / sum(res["export_obj_time"] for res in results)
+            summary[class_id]["export_glb_files_s"] = len(results) / sum(res["export_glb_time"] for res in results)
+
+    return summary
+
+
+def print_report(summary, chunks, baseline=None):
+    print(
+        f"{'class id':<12}{'files':>6}{'KB':>9}{'parse MB/s':>12}{'files/s':>9}{'build MB/s':>12}{'files/s':>9}"
+        f"{'peak MB':>9}  round trip"
+    )
+    for class_id, s in sorted(summary.items()):
+        print(
+            f"{class_id:<12}{s['files']:>6}{s['size'] / 1024:>9.1f}{s['parse_mb_s']:>12.3f}{s['parse_files_s']:>9.1f}"
+            f"{s['build_mb_s']:>12.3f}{s['build_files_s']:>9.1f}{s['parse_peak_memory'] / 1024**2:>9.2f}"
+            f"  {'ok' if s['round_trip'] else 'FAILED'}"
+        )
+        prefixes = ("lzo_", "mini_lzo_", "export_obj_", "export_glb_")
+        extra = [f"{key} {value:.3f}" for key, value in s.items() if key.startswith(prefixes)]
+        if extra:
+            print(" " * 12 + ", ".join(extra))
+        if baseline is not None and class_id in baseline["classes"]:
+            old = baseline["classes"][class_id]
+            print(
+                " " * 12
+                + f"vs baseline: parse x{s['parse_mb_s'] / old['parse_mb_s']:.2f}"
+                + f", build x{s['build_mb_s'] / old['build_mb_s']:.2f}"
+                + f", peak memory x{s['parse_peak_memory'] / old['parse_peak_memory']:.2f}"
+            )
+
+    print()
+    print(f"{'chunk id':<12}{'count':>7}{'KB':>9}{'parse ms':>10}{'MB/s':>9}{'build ms':>10}{'MB/s':>9}{'peak MB':>9}")
+    for chunk_id, s in sorted(chunks.items(), key=lambda item: -item[1].get("parse_time", 0))[:30]:
+        print(
+            f"{chunk_id:<12}{int(s.get('parse_count', 0)):>7}{s.get('parse_bytes', 0) / 1024:>9.1f}"
+            f"{s.get('parse_time', 0) * 1000:>10.2f}{mb_per_s(s.get('parse_bytes', 0), s.get('parse_time', 0)):>9.2f}"
+            f"{s.get('build_time', 0) * 1000:>10.2f}{mb_per_s(s.get('build_bytes', 0), s.get('build_time', 0)):>9.2f}"
+            f"{s.get('peak_memory', 0) / 1024**2:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Parse, build and round-trip benchmark per class id and chunk id")
+    arg_parser.add_argument("files", nargs="*", help="Gbx files to benchmark, synthetic ones when empty")
+    arg_parser.add_argument("--corpus", help="folder of the synthetic corpus, temporary by default")
+    arg_parser.add_argument("--scale", type=int, default=1, help="size multiplier of the large synthetic files")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--baseline", help="results of a previous --json run to compare with")
+    arg_parser.add_argument("--folded", help="write the parse and build stacks to this file, for flamegraph.pl")
+    args = arg_parser.parse_args()
+
+    # the nice api loads its default icon relatively
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_paths = args.files or generate_corpus(args.corpus or os.path.join(tmp_dir, "corpus"), args.scale)
+
+        files = [bench_file(file_path, args.repeat, tmp_dir) for file_path in file_paths]
+        profiler = Profiler()
+        results = {
+            "python": sys.version,
+            "lzo": "mini_lzo" if lzo is None else "python-lzo",
+            "files": files,
+            "classes": summarize(files),
+            "chunks": bench_chunks(file_paths, profiler),
+        }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_report(results["classes"], results["chunks"], baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.folded:
+        profiler.save_collapsed_stacks(args.folded)
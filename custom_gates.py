@@ -131,7 +131,7 @@ def change_textures(data, gate):
 if __name__ == "__main__":
     file = sys.argv[1]
 
-    data, nb_nodes, raw_bytes = parse_node(file)
+    data, nb_nodes, raw_bytes = parse_node(file, incremental=True)
     data.body[16].chunk.u08 = 0
 
     export_dir = Path(os.path.dirname(os.path.abspath(file)))
@@ -0,0 +1,209 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from export_obj import mesh_hash, resolve_relative_indices, to_array, transform_matrix
+
+GLB_MAGIC = 0x46546C67  # "glTF"
+GLB_JSON = 0x4E4F534A  # "JSON"
+GLB_BIN = 0x004E4942  # "BIN\0"
+
+FLOAT = 5126
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+class GlbBuilder:
+    """One binary glTF file: all the buffers are packed in one BIN chunk, meshes are referenced by nodes with their
+    transform instead of being baked at their position.
+
+    A mesh added twice with the same key (its file path) or with the same content (see mesh_hash) is written once and
+    shared by all its nodes.
+
+        glb = GlbBuilder()
+        for filepath, meshes, all_pos, all_rot in extract_meshes(data, data):
+            glb.add_node(glb.add_mesh(filepath, meshes), all_pos, all_rot, os.path.basename(filepath))
+        glb.save("export.glb")
+    """
+
+    def __init__(self):
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": "gbx-py"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [],
+            "meshes": [],
+            "materials": [],
+            "accessors": [],
+            "bufferViews": [],
+            "buffers": [],
+        }
+        self.chunks = []
+        self.size = 0
+        self.meshes_by_key = {}
+        self.meshes_by_hash = {}
+        self.materials_by_name = {}
+
+    def add_buffer_view(self, array, target):
+        # every view starts on 4 bytes, as required for float and uint32 accessors
+        data = np.ascontiguousarray(array).tobytes()
+        self.chunks.append(data)
+        self.gltf["bufferViews"].append(
+            {"buffer": 0, "byteOffset": self.size, "byteLength": len(data), "target": target}
+        )
+        padding = -len(data) % 4
+        if padding:
+            self.chunks.append(b"\x00" * padding)
+        self.size += len(data) + padding
+        return len(self.gltf["bufferViews"]) - 1
+
+    def add_accessor(self, array, target, type, with_bounds=False):
+        if array.dtype == np.float32:
+            component_type = FLOAT
+        elif array.dtype == np.uint16:
+            component_type = UNSIGNED_SHORT
+        else:
+            component_type = UNSIGNED_INT
+
+        accessor = {
+            "bufferView": self.add_buffer_view(array, target),
+            "componentType": component_type,
+            "count": len(array),
+            "type": type,
+        }
+        if with_bounds:
+            accessor["min"] = array.min(axis=0).tolist()
+            accessor["max"] = array.max(axis=0).tolist()
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"]) - 1
+
+    def add_material(self, name):
+        name = str(name)
+        if name not in self.materials_by_name:
+            self.gltf["materials"].append({"name": name})
+            self.materials_by_name[name] = len(self.gltf["materials"]) - 1
+        return self.materials_by_name[name]
+
+    def add_primitive(self, vertices, normals, uv0, indices, material_name, absolute_indice=False, lod=1):
+        N = len(vertices)
+        if not absolute_indice:
+            indices = resolve_relative_indices(indices, N) if N else []
+        indices = np.asarray(indices, dtype=np.int64)
+        # only whole triangles, glTF accessors and buffer views can't be empty
+        indices = indices[: len(indices) // 3 * 3].astype(np.uint16 if N < 1 << 16 else np.uint32)
+        if N == 0 or len(indices) == 0:
+            return None
+
+        positions = to_array(vertices, "xyz").astype(np.float32)
+        attributes = {"POSITION": self.add_accessor(positions, ARRAY_BUFFER, "VEC3", with_bounds=True)}
+
+        if len(normals) == N:
+            normals = to_array(normals, "xyz")
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+            attributes["NORMAL"] = self.add_accessor(normals.astype(np.float32), ARRAY_BUFFER, "VEC3")
+        if len(uv0) == N:
+            attributes["TEXCOORD_0"] = self.add_accessor(to_array(uv0, "xy").astype(np.float32), ARRAY_BUFFER, "VEC2")
+
+        return {
+            "attributes": attributes,
+            "indices": self.add_accessor(indices, ELEMENT_ARRAY_BUFFER, "SCALAR"),
+            "material": self.add_material(material_name),
+            "mode": 4,
+        }
+
+    def add_mesh(self, key, meshes, name=None):
+        """Index of the glTF mesh of the sub meshes of extract_solid2model, one primitive each.
+        meshes may be None if the same key was already added, as returned by extract_meshes for already extracted
+        files. Returns None for a mesh without any geometry."""
+        if key is not None and key in self.meshes_by_key:
+            return self.meshes_by_key[key]
+        if meshes is None:
+            return None
+
+        content_hash = mesh_hash(meshes)
+        if content_hash in self.meshes_by_hash:
+            if key is not None:
+                self.meshes_by_key[key] = self.meshes_by_hash[content_hash]
+            return self.meshes_by_hash[content_hash]
+
+        primitives = [self.add_primitive(*mesh) for mesh in meshes]
+        primitives = [primitive for primitive in primitives if primitive is not None]
+        mesh_index = None
+        if primitives:
+            self.gltf["meshes"].append({"name": str(name or key or len(self.gltf["meshes"])), "primitives": primitives})
+            mesh_index = len(self.gltf["meshes"]) - 1
+
+        self.meshes_by_hash[content_hash] = mesh_index
+        if key is not None:
+            self.meshes_by_key[key] = mesh_index
+        return mesh_index
+
+    def add_node(self, mesh_index, pos=None, rot=None, name=None, parent=None):
+        """Node of an instance of the mesh, pos/rot are the chains of extract_meshes (first one applied first)"""
+        node = {}
+        if name is not None:
+            node["name"] = str(name)
+        if mesh_index is not None:
+            node["mesh"] = mesh_index
+        matrix = transform_matrix(pos, rot)
+        if not np.allclose(matrix, np.identity(4)):
+            # column major
+            node["matrix"] = matrix.T.ravel().tolist()
+
+        self.gltf["nodes"].append(node)
+        node_index = len(self.gltf["nodes"]) - 1
+        if parent is None:
+            self.gltf["scenes"][0]["nodes"].append(node_index)
+        else:
+            self.gltf["nodes"][parent].setdefault("children", []).append(node_index)
+        return node_index
+
+    def add_meshes(self, all_meshes, parent=None):
+        """Nodes of the (filepath, meshes, pos, rot) returned by extract_meshes"""
+        for filepath, meshes, all_pos, all_rot in all_meshes:
+            mesh_index = self.add_mesh(filepath, meshes)
+            if mesh_index is not None:
+                self.add_node(mesh_index, all_pos, all_rot, os.path.basename(str(filepath)), parent)
+
+    def to_bytes(self):
+        gltf = {key: value for key, value in self.gltf.items() if value != []}
+        # a scene needs at least one node
+        gltf["scenes"] = [{key: value for key, value in scene.items() if value != []} for scene in gltf["scenes"]]
+        if self.size:
+            gltf["buffers"] = [{"byteLength": self.size}]
+
+        json_bytes = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+        json_bytes += b" " * (-len(json_bytes) % 4)
+        bin_bytes = b"".join(self.chunks)
+
+        chunks = [struct.pack("<II", len(json_bytes), GLB_JSON), json_bytes]
+        if bin_bytes:
+            chunks += [struct.pack("<II", len(bin_bytes), GLB_BIN), bin_bytes]
+        body = b"".join(chunks)
+        return struct.pack("<III", GLB_MAGIC, 2, 12 + len(body)) + body
+
+    def save(self, filename):
+        export_dir = os.path.dirname(filename)
+        if export_dir and not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+        with open(filename, "wb") as f:
+            f.write(self.to_bytes())
+
+
+def export_glb(filename, all_meshes):
+    """All the meshes returned by extract_meshes in one .glb file, the meshes of the same file are shared"""
+    glb = GlbBuilder()
+    glb.add_meshes(all_meshes)
+    glb.save(filename)
+
+
+def export_glb_meshes(filename, meshes, pos=None, rot=None):
+    """The sub meshes returned by extract_solid2model in one .glb file"""
+    glb = GlbBuilder()
+    glb.add_node(glb.add_mesh(None, meshes, os.path.basename(filename)), pos, rot)
+    glb.save(filename)
@@ -1,4 +1,7 @@
+import hashlib
+import json
 import os
+import numpy as np
 from construct import Container, ListContainer
 
 
@@ -70,7 +73,8 @@ def transform_final_pos(ps, qs):
 
 
 def transform_pos(pos, ps, qs, blender_space):
-    x, y, z = pos.x, pos.y, pos.z
+    # vertex streams are float32 numpy records, keep the math and the output in python floats
+    x, y, z = float(pos.x), float(pos.y), float(pos.z)
 
     if ps is not None:
         for i in range(len(ps)):
@@ -89,6 +93,65 @@ def transform_pos(pos, ps, qs, blender_space):
         return [x, y, z]
 
 
+def resolve_relative_indices(indices, N):
+    """Index buffers store each indice as a delta from the previous one, modulo the vertex count"""
+    return np.cumsum(np.asarray(indices, dtype=np.int64)) % N
+
+
+def quaternion_matrix(q):
+    """3x3 rotation matrix of quaternion_rotation"""
+    q0, q1, q2, q3 = float(q.w), float(q.x), float(q.y), float(q.z)
+    return np.array(
+        [
+            [2 * (q0 * q0 + q1 * q1) - 1, 2 * (q1 * q2 - q0 * q3), 2 * (q1 * q3 + q0 * q2)],
+            [2 * (q1 * q2 + q0 * q3), 2 * (q0 * q0 + q2 * q2) - 1, 2 * (q2 * q3 - q0 * q1)],
+            [2 * (q1 * q3 - q0 * q2), 2 * (q2 * q3 + q0 * q1), 2 * (q0 * q0 + q3 * q3) - 1],
+        ]
+    )
+
+
+BLENDER_SPACE = np.array(
+    [
+        [1.0, 0.0, 0.0, 0.0],
+        [0.0, 0.0, -1.0, 0.0],
+        [0.0, 1.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ]
+)
+
+
+def transform_matrix(ps, qs, blender_space=False):
+    """4x4 matrix of transform_pos: the first pos/rot is applied first"""
+    matrix = np.identity(4)
+    if ps is not None:
+        for p, q in zip(ps, qs):
+            step = np.identity(4)
+            step[:3, :3] = quaternion_matrix(q)
+            step[:3, 3] = (float(p.x), float(p.y), float(p.z))
+            matrix = step @ matrix
+
+    if blender_space:
+        matrix = BLENDER_SPACE @ matrix
+    return matrix
+
+
+def to_array(values, names):
+    """(N, len(names)) float array of a vertex stream (numpy records) or of a list of Containers"""
+    if isinstance(values, np.ndarray) and values.dtype.names is not None:
+        return np.stack([values[name] for name in names], axis=1).astype(np.float64)
+    if len(values) == 0:
+        return np.zeros((0, len(names)))
+    return np.array([[float(v[name]) for name in names] for v in values])
+
+
+def format_rows(prefix, rows):
+    """One line per row, python floats are written as they were with f-strings"""
+    if len(rows) == 0:
+        return ""
+    line = prefix + " %r" * rows.shape[1] + "\n"
+    return (line * len(rows)) % tuple(rows.ravel().tolist())
+
+
 def export_obj(
     filename,
     vertices,
@@ -108,34 +171,38 @@ def export_obj(
 
     export_dir = os.path.dirname(filename)
     if not os.path.exists(export_dir):
-        os.makedirs(export_dir)
-
-    with open(filename, "w") as f:
-        f.write(f"o {os.path.basename(filename)}\n")
-        for v in vertices:
-            v2 = transform_pos(v, pos, rot, blender_space)
-            f.write(f"v {v2[0]} {v2[1]} {v2[2]}\n")
-        for n in normals:
-            n2 = transform_pos(n, pos, rot, blender_space)
-            f.write(f"vn {n2[0]} {n2[1]} {n2[2]}\n")
-        for uv in uv0:
-            f.write(f"vt {uv.x} {uv.y}\n")
-        f.write(f"usemtl {material_name}\n")
-
-        current_indice = 0
-        for i, indice in enumerate(indices):
-            if absolute_indice:
-                current_indice = indice
-            else:
-                current_indice = (current_indice + indice) % N
-
-            if (i % 3) == 0:
-                f.write("f")
-
-            f.write(f" {current_indice+1}/{current_indice+1}/{current_indice+1}")
-
-            if (i % 3) == 2:
-                f.write("\n")
+        os.makedirs(export_dir, exist_ok=True)
+
+    # all the pos/rot are composed once, then applied to all the vertices at once
+    matrix = transform_matrix(pos, rot, blender_space)
+    vertices = to_array(vertices, "xyz") @ matrix[:3, :3].T + matrix[:3, 3]
+    # normals are directions, they are only rotated
+    normals = to_array(normals, "xyz") @ matrix[:3, :3].T
+    uv0 = to_array(uv0, "xy")
+
+    if not absolute_indice:
+        indices = resolve_relative_indices(indices, N)
+    indices = np.asarray(indices, dtype=np.int64) + 1
+    nb_faces = len(indices) // 3
+    faces = np.repeat(indices[: nb_faces * 3], 3)
+
+    lines = [
+        f"o {os.path.basename(filename)}\n",
+        format_rows("v", vertices),
+        format_rows("vn", normals),
+        format_rows("vt", uv0),
+        f"usemtl {material_name}\n",
+        ("f %d/%d/%d %d/%d/%d %d/%d/%d\n" * nb_faces) % tuple(faces.tolist()),
+    ]
+    if len(indices) % 3:
+        # an incomplete last face is written as it is
+        lines.append("f" + "".join(f" {i}/{i}/{i}" for i in indices[nb_faces * 3 :].tolist()))
+
+    # written aside then moved, several processes may export the same file
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        f.write("".join(lines))
+    os.replace(tmp_filename, filename)
 
 
 def export_obj2(filename, vertices, faces, material_name):  # surf
@@ -230,6 +297,21 @@ def extract_solid2model(root_node, node):
     return meshes
 
 
+def mesh_hash(meshes):
+    """Hash of the geometry and materials of the sub meshes of extract_solid2model, identical meshes of different
+    files have the same hash"""
+    h = hashlib.sha1()
+    for vertices, normals, uv0, indices, material_name, absolute_indice, lod in meshes:
+        if not absolute_indice:
+            indices = resolve_relative_indices(indices, len(vertices))
+        h.update(f"{material_name}|{lod}|{len(vertices)}|{len(normals)}|{len(uv0)}|{len(indices)}".encode("utf-8"))
+        h.update(to_array(vertices, "xyz").astype(np.float32).tobytes())
+        h.update(to_array(normals, "xyz").astype(np.float32).tobytes())
+        h.update(to_array(uv0, "xy").astype(np.float32).tobytes())
+        h.update(np.asarray(indices, dtype=np.uint32).tobytes())
+    return h.hexdigest()[:16]
+
+
 def export_meshes(export_dir, filename, meshes, pos=None, rot=None):
     if meshes is None:
         return
@@ -242,7 +324,14 @@ def export_meshes(export_dir, filename, meshes, pos=None, rot=None):
         export_obj(obj_filepath, *sub_mesh, pos, rot)
 
 
-def export_ents(export_dir, file, data, offset_index=None, off_pos=None, off_rot=None):
+def export_ents(export_dir, file, data, offset_index=None, off_pos=None, off_rot=None, exported=None, instances=None):
+    """Each unique mesh is exported once, untransformed. The entities using it are written in
+    {file}_instances.json with their transform matrix. Returns the instances."""
+    top_level = instances is None
+    if exported is None:
+        exported = {}  # mesh hash: filename of its obj files
+    if instances is None:
+        instances = []
     if offset_index is None:
         offset_index = []
     if off_pos is None:
@@ -264,6 +353,8 @@ def export_ents(export_dir, file, data, offset_index=None, off_pos=None, off_rot
                 [*offset_index, ent_idx],
                 off_pos,
                 off_rot,
+                exported,
+                instances,
             )
             return None
         if static_node.classId == 0x900C000:
@@ -282,6 +373,8 @@ def export_ents(export_dir, file, data, offset_index=None, off_pos=None, off_rot
                 [*offset_index, ent_idx],
                 off_pos,
                 off_rot,
+                exported,
+                instances,
             )
             return None
         if node.classId == 0x09159000:
@@ -306,7 +399,21 @@ def export_ents(export_dir, file, data, offset_index=None, off_pos=None, off_rot
             + "_".join(map(str, offset_index))
             + f"_{ent_idx}"
         )
-        export_meshes(export_dir, filename, meshes, final_pos, final_rot)
+        if meshes is None:
+            continue
+
+        key = mesh_hash(meshes)
+        if key not in exported:
+            exported[key] = filename
+            export_meshes(export_dir, filename, meshes)
+        instances.append(
+            {"ent": filename, "mesh": exported[key], "matrix": transform_matrix(final_pos, final_rot).tolist()}
+        )
+
+    if top_level:
+        with open(export_dir + os.path.basename(file).split(".")[0] + "_instances.json", "w") as f:
+            json.dump(instances, f)
+    return instances
 
 
 def extract_meshes(root_data, data, off_pos=None, off_rot=None, extracted_files=None):
@@ -1,10 +1,15 @@
 # pyinstaller.exe --onefile --paths=./ export_obj_script.py
+#
+# python export_obj_script.py file.Item.Gbx [--glb]
+#
+# With --glb, all the meshes are written in one export_obj/file.Item.glb, meshes used several times are shared.
 
 import sys
 import os
 from src.parser import parse_node
 from src.utils_bloc import extract_meshes
 from export_obj import export_obj
+from export_glb import export_glb
 
 from construct import Container
 
@@ -19,6 +24,13 @@ if __name__ == "__main__":
 
     entity_model = item_data.nodes[item_data.body[12].chunk.EntityModel]
     all_meshes = extract_meshes(item_data, entity_model)
+
+    if "--glb" in sys.argv[2:]:
+        glb_filepath = export_folder + os.sep + os.path.basename(sys.argv[1]).rsplit(".", 1)[0] + ".glb"
+        export_glb(glb_filepath, all_meshes)
+        print(glb_filepath)
+        sys.exit(0)
+
     for filepath, meshes, all_pos, all_rot in all_meshes:
         export_folder_file = export_folder + os.sep + filepath + os.sep
         for idx, obj_params in enumerate(meshes):
@@ -10,7 +10,7 @@ from PIL import Image, ImageDraw
 
 from src.parser import parse_node, generate_node, parse_node_recursive
 from src.editor import GbxEditorUi
-from src.utils_bloc import extract_block_meshes2
+from src.utils_bloc import extract_block_meshes2, load_mesh_paths, save_mesh_paths
 from export_obj import export_ents, extract_solid2model, export_meshes
 
 if __name__ == "__main__2":
@@ -92,6 +92,8 @@ if __name__ == "__main__2":
         "export_folder": export_folder,
         "extracted_files": set(files),
     }
+    # the meshes kept by the previous runs, their duplicates are not exported again
+    load_mesh_paths(result)
     blocks = []
     clips_to_extract = set()
 
@@ -124,3 +126,4 @@ if __name__ == "__main__2":
     }
     with open(export_folder + "tm2.json", "w") as fp:
         json.dump(tm_json, fp)
+    save_mesh_paths(result)
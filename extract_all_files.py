@@ -5,7 +5,7 @@ from multiprocessing import Pool
 
 from runtime_params import get_extract_tm2020_path
 from items_list import items_filepaths
-from gbx_parser import GbxStructWithoutBodyParsed
+from src.parser import scan_node
 
 
 def construct_all_folders(all_folders, parent_folder_path, current_folder):
@@ -15,11 +15,11 @@ def construct_all_folders(all_folders, parent_folder_path, current_folder):
 
 
 def get_external_folders(data, filepath):
-    external_folders = data.reference_table.external_folders
+    external_folders = data.referenceTable.externalFolders
     root_folder_name = os.path.dirname(filepath) + "/"
     all_folders = [root_folder_name]
     if external_folders is not None:
-        root_folder_name += "../" * external_folders.ancestor_level
+        root_folder_name += "../" * external_folders.ancestorLevel
         construct_all_folders(all_folders, root_folder_name, external_folders)
 
     return all_folders
@@ -34,35 +34,26 @@ def get_missing_files(filepath, all_reached_files):
     if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
         return [filepath]
 
-    with open(filepath, "rb") as f:
-        raw_bytes = f.read()
-
-        gbx_data = {}
-        nodes = []
-        try:
-            data = GbxStructWithoutBodyParsed.parse(
-                raw_bytes, gbx_data=gbx_data, nodes=nodes, filename=filepath
-            )
-        except:
-            return [filepath]
-
-        all_sub_missing_files = []
-
-        external_folders = get_external_folders(data, filepath)
-        for external_node in data.reference_table.external_nodes:
-            if not external_node.ref.endswith(
-                ".gbx"
-            ) and not external_node.ref.endswith(".Gbx"):
-                continue
-            else:
-                ext_node_filepath = os.path.normpath(
-                    external_folders[external_node.folder_index] + external_node.ref
-                )
-                all_sub_missing_files += get_missing_files(
-                    ext_node_filepath, all_reached_files
-                )
-
-        return all_sub_missing_files
+    try:
+        data = scan_node(filepath)
+    except:
+        data = None
+    if data is None:
+        return [filepath]
+
+    all_sub_missing_files = []
+
+    external_folders = get_external_folders(data, filepath)
+    for external_node in data.referenceTable.externalNodes:
+        if type(external_node.ref) is not str:
+            continue
+        elif not external_node.ref.endswith(".gbx") and not external_node.ref.endswith(".Gbx"):
+            continue
+        else:
+            ext_node_filepath = os.path.normpath(external_folders[external_node.folderIndex] + external_node.ref)
+            all_sub_missing_files += get_missing_files(ext_node_filepath, all_reached_files)
+
+    return all_sub_missing_files
 
 
 if __name__ == "__main__":
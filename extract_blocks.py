@@ -0,0 +1,358 @@
+# python extract_blocks.py [--jobs 32] [--pattern "Stadium\GameCtnBlockInfo\GameCtnBlockInfoClassic\*.EDClassic.Gbx"]
+#                          [--parse-cache folder] [--force] base_folder export_folder
+#
+# Same output as the extraction in extract_all_blocks.py (the obj files and export_folder/tm2.json), but the blocks
+# then their clips are extracted with extract_block_meshes2 in a process pool. The workers share the on disk parse
+# cache, so a dependency (prefab, mesh, material...) is parsed once for all of them.
+#
+# export_folder/manifest.json keeps the hashes of each block or clip and of all the files it depends on. On the next
+# run, only the blocks and clips with a changed file are extracted again, --force extracts everything.
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+
+import src.parser
+from runtime_params import parse_cache_dir, parse_cache_max_size_mb
+from src.parse_cache import DiskCache, NodeCache, get_parser_version
+from src.parser import parse_node_recursive, scan_dependencies
+from src.utils_bloc import extract_block_meshes2
+
+MANIFEST_VERSION = 1
+
+CLIPS_PROPS = ("clipsNorth", "clipsEast", "clipsSouth", "clipsWest", "clipsTop", "clipsBottom")
+
+# state of a worker process, kept from one file to the next
+worker_result = None
+worker_node_cache = None
+
+
+def init_worker(base_folder, export_folder, extracted_files, cache_dir, node_cache_mb):
+    global worker_result, worker_node_cache
+
+    worker_result = {
+        "base_folder": base_folder,
+        "export_folder": export_folder,
+        "extracted_files": set(extracted_files),
+        # workers can't see each other meshes, identical meshes are deduped by merge_fragments
+        "dedup_meshes": False,
+    }
+    worker_node_cache = NodeCache(max_bytes=node_cache_mb * 1024**2)
+    if cache_dir:
+        src.parser.parse_cache = DiskCache(cache_dir, parse_cache_max_size_mb * 1024**2)
+
+
+def mesh_paths(block):
+    for variant in block["variants"].values():
+        for mobil in variant["mobils"].values():
+            for mesh in mobil.get("meshes", []):
+                yield mesh["path"]
+
+
+def clip_paths(block):
+    for variant in block["variants"].values():
+        for block_unit in variant["blocks_units"]:
+            for prop in CLIPS_PROPS:
+                yield from block_unit.get(prop, [])
+
+
+def extract_file(file_path, stale_files=()):
+    """Fragment of tm2.json of one block or clip, with the mesh_hash of the meshes it uses.
+    stale_files are exported again even if they were already extracted."""
+    start = time.perf_counter()
+    worker_result["extracted_files"].difference_update(stale_files)
+    data, nb_nodes, raw_bytes = parse_node_recursive(file_path, cache=worker_node_cache)
+    block = extract_block_meshes2(worker_result, os.path.basename(file_path), data)
+
+    mesh_hashes = worker_result.get("mesh_hashes", {})
+    return {
+        "file": file_path,
+        "block": block,
+        "mesh_hashes": {path: mesh_hashes[path] for path in mesh_paths(block) if path in mesh_hashes},
+        "time": time.perf_counter() - start,
+    }
+
+
+def extract_all(executor, file_paths, label, stale_files=()):
+    """Fragments of the files sorted by file path, whatever the order the workers finish in"""
+    fragments = []
+    failed = []
+    start = time.perf_counter()
+
+    futures = {executor.submit(extract_file, file_path, stale_files): file_path for file_path in file_paths}
+    for i, future in enumerate(as_completed(futures)):
+        try:
+            fragment = future.result()
+            fragments.append(fragment)
+            status = f"{fragment['time']:.1f}s"
+        except Exception as e:
+            failed.append((futures[future], e))
+            status = f"FAILED {e}"
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"[{label} {i + 1}/{len(futures)}] {os.path.basename(futures[future])} {status}"
+            f" ({(i + 1) / elapsed:.2f} files/s)"
+        )
+
+    return sorted(fragments, key=lambda fragment: fragment["file"]), failed
+
+
+def mesh_folder(export_folder, path):
+    return export_folder + path + "\\"
+
+
+def canonical_mesh_paths(mesh_hashes, export_folder=None):
+    """Path of the meshes to use instead of each path of mesh_hashes: the smallest path with the same hash, among the
+    ones still exported in export_folder if any"""
+    paths_by_hash = {}
+    for path, key in mesh_hashes.items():
+        paths_by_hash.setdefault(key, set()).add(path)
+
+    canonical_paths = {}
+    for paths in paths_by_hash.values():
+        exported = [path for path in paths if export_folder is None or os.path.isdir(mesh_folder(export_folder, path))]
+        canonical_path = min(exported or paths)
+        for path in paths:
+            canonical_paths[path] = canonical_path
+    return canonical_paths
+
+
+def merge_fragments(fragments, export_folder=None, mesh_hashes=None):
+    """Blocks of the fragments in the same order, identical meshes exported by different workers (or in previous
+    runs, see mesh_hashes) are replaced by the one with the smallest path. With export_folder, the obj files of the
+    replaced ones are removed."""
+    mesh_hashes = dict(mesh_hashes or {})
+    for fragment in fragments:
+        mesh_hashes.update(fragment["mesh_hashes"])
+    canonical_paths = canonical_mesh_paths(mesh_hashes, export_folder)
+
+    blocks = []
+    for fragment in fragments:
+        block = fragment["block"]
+        for variant in block["variants"].values():
+            for mobil in variant["mobils"].values():
+                for mesh in mobil.get("meshes", []):
+                    mesh["path"] = canonical_paths.get(mesh["path"], mesh["path"])
+        blocks.append(block)
+
+    if export_folder is not None:
+        for path, canonical_path in sorted(canonical_paths.items()):
+            if path != canonical_path and os.path.isdir(mesh_folder(export_folder, canonical_path)):
+                shutil.rmtree(mesh_folder(export_folder, path), ignore_errors=True)
+
+    return blocks
+
+
+def exporter_version():
+    """Changes whenever the parser or the exporter change, the manifest of another version is not used"""
+    h = hashlib.sha1(get_parser_version().encode())
+    for module_path in ("export_obj.py", os.path.join("src", "utils_bloc.py")):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module_path), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_manifest(manifest_path, force=False):
+    empty = {"version": MANIFEST_VERSION, "exporter": exporter_version(), "files": {}, "mesh_hashes": {}, "outputs": {}}
+    if force:
+        return empty
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("exporter") != empty["exporter"]:
+        return empty
+    return manifest
+
+
+class DependencyHashes:
+    """sha1 of the files and of their dependencies, a file is only read again if its size or mtime changed since the
+    previous manifest"""
+
+    def __init__(self, old_files):
+        self.old_files = old_files  # path: [size, mtime_ns, sha1]
+        self.files = {}
+        self.dependencies = {}  # shared by all the scans, see scan_dependencies
+
+    def file_hash(self, file_path):
+        if file_path not in self.files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+            old = self.old_files.get(file_path)
+            if old is not None and old[:2] == [stat.st_size, stat.st_mtime_ns]:
+                self.files[file_path] = old
+            else:
+                with open(file_path, "rb") as f:
+                    self.files[file_path] = [stat.st_size, stat.st_mtime_ns, hashlib.sha1(f.read()).hexdigest()]
+        return self.files[file_path][2]
+
+    def closure(self, file_path):
+        """Hashes of the file and of all the files it depends on, by path"""
+        file_path = os.path.abspath(file_path)
+        scan_dependencies(file_path, self.dependencies)
+
+        hashes = {}
+        stack = [file_path]
+        while stack:
+            path = stack.pop()
+            if path in hashes:
+                continue
+            hashes[path] = self.file_hash(path)
+            stack.extend(self.dependencies.get(path, []))
+        return dict(sorted(hashes.items()))
+
+    def unchanged(self, file_path):
+        """Whether the file and its dependencies are the same as in the previous manifest"""
+        return all(
+            path in self.old_files and self.old_files[path][2] == key for path, key in self.closure(file_path).items()
+        )
+
+
+def extract_outdated(executor, file_paths, label, manifest, hashes, outputs):
+    """Fragments of the files, the ones of the unchanged files are taken from the manifest"""
+    to_extract = []
+    fragments = []
+    for file_path in file_paths:
+        dependencies = hashes.closure(file_path)
+        output = manifest["outputs"].get(file_path)
+        if output is not None and output["dependencies"] == dependencies:
+            fragments.append(output["fragment"])
+        else:
+            to_extract.append(file_path)
+        outputs[file_path] = {"dependencies": dependencies}
+
+    print(f"{label}: {len(to_extract)} to extract, {len(fragments)} unchanged")
+    extracted, failed = extract_all(executor, to_extract, label)
+    for file_path, _ in failed:
+        del outputs[file_path]
+    return sorted(fragments + extracted, key=lambda fragment: fragment["file"]), failed
+
+
+def extract_blocks(base_folder, export_folder, pattern, jobs=None, cache_dir=None, node_cache_mb=512, force=False):
+    os.makedirs(export_folder, exist_ok=True)
+    manifest_path = export_folder + "manifest.json"
+    manifest = load_manifest(manifest_path, force)
+    hashes = DependencyHashes(manifest["files"])
+    outputs = {}
+
+    all_blocks = sorted(glob(base_folder + pattern))
+    files = glob(export_folder + "**", recursive=True)
+    files = [f.replace(export_folder, base_folder) for f in files if f.endswith("bx")]
+    # the meshes of a changed file are exported again
+    files = [f for f in files if hashes.unchanged(f)]
+    # so is their hash, the one of the others is still valid
+    mesh_hashes = {
+        path: key for path, key in manifest["mesh_hashes"].items() if hashes.unchanged(base_folder + path)
+    }
+    print(f"{len(all_blocks)} blocks, {len(files)} files already extracted")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=init_worker,
+        initargs=(base_folder, export_folder, files, cache_dir, node_cache_mb),
+    ) as executor:
+        block_fragments, failed = extract_outdated(executor, all_blocks, "blocks", manifest, hashes, outputs)
+
+        clips_to_extract = sorted({clip for fragment in block_fragments for clip in clip_paths(fragment["block"])})
+        clip_fragments, failed_clips = extract_outdated(
+            executor, [base_folder + clip for clip in clips_to_extract], "clips", manifest, hashes, outputs
+        )
+        failed += failed_clips
+        fragments = block_fragments + clip_fragments
+
+        # meshes exported in a previous run and removed as duplicates of a mesh which has changed since
+        for fragment in fragments:
+            mesh_hashes.update(fragment["mesh_hashes"])
+        canonical_paths = canonical_mesh_paths(mesh_hashes, export_folder)
+        missing = sorted(
+            path
+            for path, canonical_path in canonical_paths.items()
+            if not os.path.isdir(mesh_folder(export_folder, canonical_path))
+        )
+        if missing:
+            to_extract = [
+                fragment["file"] for fragment in fragments if not set(missing).isdisjoint(mesh_paths(fragment["block"]))
+            ]
+            extracted, failed_again = extract_all(
+                executor, to_extract, "missing meshes", [base_folder + path for path in missing]
+            )
+            failed += failed_again
+            extracted = {fragment["file"]: fragment for fragment in extracted}
+            fragments = [extracted.get(fragment["file"], fragment) for fragment in fragments]
+            for path in missing:
+                mesh_hashes.pop(path, None)
+
+    # the fragments are kept in the manifest as extracted, before their meshes are deduped
+    for fragment in fragments:
+        outputs[fragment["file"]]["fragment"] = copy.deepcopy(fragment)
+        mesh_hashes.update(fragment["mesh_hashes"])
+
+    blocks = merge_fragments(fragments, export_folder, mesh_hashes)
+    tm_json = {
+        "blocks": sorted(blocks[: len(block_fragments)], key=lambda b: b["id"]),
+        "clips": sorted(blocks[len(block_fragments) :], key=lambda b: b["id"]),
+    }
+    with open(export_folder + "tm2.json", "w") as fp:
+        json.dump(tm_json, fp)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "exporter": manifest["exporter"],
+        "files": dict(sorted(hashes.files.items())),
+        "mesh_hashes": dict(sorted(mesh_hashes.items())),
+        "outputs": {file_path: output for file_path, output in sorted(outputs.items()) if "fragment" in output},
+    }
+    with open(manifest_path + ".tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    for file_path, e in failed:
+        print(f"[EXTRACT FAILED] {file_path} {e}")
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(fragments)} files in {elapsed:.1f}s ({len(fragments) / elapsed:.2f} files/s), {len(failed)} failed")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Extract the meshes of the blocks and their clips")
+    arg_parser.add_argument("base_folder", help="extracted game data, ending with a separator")
+    arg_parser.add_argument("export_folder", help="ending with a separator")
+    arg_parser.add_argument(
+        "--pattern",
+        default=r"Stadium\GameCtnBlockInfo\GameCtnBlockInfoClassic\*.EDClassic.Gbx",
+        help="glob of the blocks, relative to base_folder",
+    )
+    arg_parser.add_argument("--jobs", type=int, default=None, help="number of processes, all the cores by default")
+    arg_parser.add_argument(
+        "--parse-cache",
+        default=parse_cache_dir or None,
+        help="folder of the parse cache shared by the workers, GBX_PY_PARSE_CACHE_DIR or a folder next to export_folder"
+        " (export_folder_parse_cache) by default",
+    )
+    arg_parser.add_argument(
+        "--node-cache-mb", type=int, default=512, help="parsed dependencies kept in memory by each worker"
+    )
+    arg_parser.add_argument("--force", action="store_true", help="ignore the manifest, extract everything again")
+    args = arg_parser.parse_args()
+
+    extract_blocks(
+        args.base_folder,
+        args.export_folder,
+        args.pattern,
+        args.jobs,
+        # next to the export folder, not in it: the exported files are globbed on each run
+        args.parse_cache or os.path.normpath(args.export_folder) + "_parse_cache",
+        args.node_cache_mb,
+        args.force,
+    )
@@ -66,7 +66,7 @@ if __name__ == "__main__":
     file = sys.argv[1]
 
     export_dir = Path(os.path.dirname(os.path.abspath(file)))
-    data, nb_nodes, raw_bytes = parse_node(file)
+    data, nb_nodes, raw_bytes = parse_node(file, incremental=True)
 
     add_cp_from_trigger(data)
     data.body[16].chunk.waypointType = "Checkpoint"
@@ -1,30 +1,116 @@
 # pyinstaller.exe --onefile --paths=./ recompress.py
+#
+# python recompress.py [--level 1] [--jobs 8] [--output out_folder] [--in-place] file_or_folder...
+#
+# Without --output nor --in-place, name.Item.Gbx is written next to the original as name_recompressed.Item.Gbx.
+# Folders are walked recursively and their files are recompressed in a process pool.
 
-import sys
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from gbx_parser import GbxStructWithoutBodyParsed
+from construct import ListContainer
 
-if __name__ == "__main__":
-    file_path = sys.argv[1]
+from src.gbx_structs import GbxStructWithoutBodyParsed, LzoCompression
+
+
+def recompress_bytes(raw_bytes, file_path=None, compression=None):
+    """Only the header is parsed, the body is decompressed as raw bytes and compressed again."""
+    nodes = ListContainer()
+    data = GbxStructWithoutBodyParsed.parse(raw_bytes, gbx_data={}, nodes=nodes, filename=file_path)
+
+    data.bodyCompression = "compressed"
+    return GbxStructWithoutBodyParsed.build(data, gbx_data={}, nodes=nodes, compression=compression)
+
+
+def recompressed_path(file_path):
+    """name.Item.Gbx -> name_recompressed.Item.Gbx, in the same folder"""
+    folder, file_name = os.path.split(file_path)
+    name, dot, suffixes = file_name.partition(".")
+    return os.path.join(folder, name + "_recompressed" + dot + suffixes)
 
+
+def recompress_file(file_path, out_path, level):
     with open(file_path, "rb") as f:
         raw_bytes = f.read()
 
-        gbx_data = {}
-        nodes = []
-        data = GbxStructWithoutBodyParsed.parse(
-            raw_bytes, gbx_data=gbx_data, nodes=nodes, filename=file_path
-        )
-
-        gbx_data = {}
-        # compression
-        data.header.body_compression = "compressed"
-        new_bytes = GbxStructWithoutBodyParsed.build(
-            data, gbx_data=gbx_data, nodes=nodes
-        )
-
-        elems = file_path.split(".")
-        elems[-3] += "_recompressed"
-        file_path2 = ".".join(elems)
-        with open(file_path2, "wb") as f:
-            f.write(new_bytes)
+    new_bytes = recompress_bytes(raw_bytes, file_path, LzoCompression(level))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    # written aside then moved, an interrupted batch never leaves a truncated file (nor original with --in-place)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(new_bytes)
+    os.replace(tmp_path, out_path)
+
+    return len(raw_bytes), len(new_bytes)
+
+
+def collect_jobs(paths, output=None, in_place=False):
+    """(file path, output path) of every gbx file in paths, folders included"""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, file_names in os.walk(path):
+                for file_name in sorted(file_names):
+                    if not file_name.lower().endswith(".gbx") or "_recompressed." in file_name:
+                        continue
+                    file_path = os.path.join(folder, file_name)
+                    if output:
+                        out_path = os.path.join(output, os.path.relpath(file_path, path))
+                    else:
+                        out_path = file_path if in_place else recompressed_path(file_path)
+                    jobs.append((file_path, out_path))
+        elif output:
+            jobs.append((path, os.path.join(output, os.path.basename(path))))
+        else:
+            jobs.append((path, path if in_place else recompressed_path(path)))
+    return jobs
+
+
+def recompress_all(jobs, level=9, max_workers=None):
+    """Returns the (file path, old size, new size) of the recompressed files and the (file path, error) of the others"""
+    done = []
+    failed = []
+
+    if len(jobs) == 1 or max_workers == 1:
+        for file_path, out_path in jobs:
+            try:
+                done.append((file_path, *recompress_file(file_path, out_path, level)))
+            except Exception as e:
+                failed.append((file_path, e))
+        return done, failed
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(recompress_file, file_path, out_path, level): file_path for file_path, out_path in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                done.append((futures[future], *future.result()))
+            except Exception as e:
+                failed.append((futures[future], e))
+
+    return done, failed
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compress the body of gbx files again")
+    arg_parser.add_argument("paths", nargs="+", help="gbx files or folders")
+    arg_parser.add_argument(
+        "--level", type=int, default=9, help="1 is LZO1X-1 (fast), 2 to 9 is LZO1X-999 (smallest, as the game does)"
+    )
+    arg_parser.add_argument("--jobs", type=int, default=None, help="number of processes, all the cores by default")
+    arg_parser.add_argument("--output", help="folder where the recompressed files are written, with the same tree")
+    arg_parser.add_argument("--in-place", action="store_true", help="overwrite the original files")
+    args = arg_parser.parse_args()
+
+    jobs = collect_jobs(args.paths, args.output, args.in_place)
+    done, failed = recompress_all(jobs, args.level, args.jobs)
+
+    for file_path, e in failed:
+        print(f"[RECOMPRESS FAILED] {file_path} {e}")
+
+    old_size = sum(old for _, old, _ in done)
+    new_size = sum(new for _, _, new in done)
+    print(f"{len(done)} files recompressed, {old_size / 1024:.1f} KB -> {new_size / 1024:.1f} KB")
@@ -22,3 +22,13 @@ def get_author_name() -> str:
     return os.environ("GBX_PY_AUTHOR_NAME", "schadocalex")
 
 hex_window_width_px = int(os.environ.get("GBX_PY_HEX_WINDOW_WIDTH", "538"))
+
+# parsed files are cached on disk when set, shared by all scripts
+parse_cache_dir = os.environ.get("GBX_PY_PARSE_CACHE_DIR", "")
+parse_cache_max_size_mb = int(os.environ.get("GBX_PY_PARSE_CACHE_MAX_SIZE_MB", "2048"))
+
+# body chunks are compiled by construct when set, faster parsing but a few seconds at startup
+compiled_parser = os.environ.get("GBX_PY_COMPILED_PARSER", "") not in ("", "0")
+
+# LZO level of the generated files, 1 is much faster to build, 9 is the smallest (as the game does)
+lzo_compression_level = int(os.environ.get("GBX_PY_LZO_LEVEL", "9"))
@@ -0,0 +1,236 @@
+import numpy as np
+from construct import Container, ListContainer
+
+# (name, first bit, bit count) of GbxBlockInstance.flags
+FLAG_FIELDS = (
+    ("mobilIndex", 0, 6),
+    ("mobilVariantIndex", 6, 6),
+    ("isGround", 12, 1),
+    ("isClip", 13, 1),
+    ("u01", 14, 1),
+    ("isSkinnable", 15, 1),
+    ("u02a", 16, 1),
+    ("hasU06", 17, 1),
+    ("hasObsolete0", 18, 1),
+    ("hasU05", 19, 1),
+    ("isWaypoint", 20, 1),
+    ("blockVariantIndex", 21, 7),
+    ("isGhost", 28, 1),
+    ("isFree", 29, 1),
+    ("u04", 30, 2),
+)
+FLAG_BITS = {name: (shift, size) for name, shift, size in FLAG_FIELDS}
+
+CARDINAL_DIRS = ("North", "East", "South", "West")
+
+# fields of a block only present depending on its flags, they may hold nodes
+EXTRA_FIELDS = ("skinParams", "u05", "waypointParams", "obsolete0", "u06")
+
+BLOCKS_CHUNKS = {0x0304301F: "blocks", 0x03043048: "BakedBlocks"}
+
+
+def decode_flags(flags):
+    """Bit fields of an array of flags, as arrays. Blocks without flags (-1) decode to garbage, see has_flags."""
+    flags = np.asarray(flags, dtype=np.int64) & 0xFFFFFFFF
+    fields = {}
+    for name, shift, size in FLAG_FIELDS:
+        values = (flags >> shift) & ((1 << size) - 1)
+        fields[name] = values.astype(bool) if size == 1 else values.astype(np.uint8)
+    return fields
+
+
+def encode_flags(fields):
+    """Inverse of decode_flags, missing fields are 0"""
+    flags = None
+    for name, shift, size in FLAG_FIELDS:
+        if name not in fields:
+            continue
+        values = (np.asarray(fields[name], dtype=np.int64) & ((1 << size) - 1)) << shift
+        flags = values if flags is None else flags | values
+    if flags is None:
+        return np.zeros(0, dtype=np.int64)
+    # bit 31 set means a negative Int32sl
+    return np.where(flags >= 1 << 31, flags - (1 << 32), flags)
+
+
+class BlockTable:
+    """Blocks of chunk 0x0304301F (blocks) or 0x03043048 (BakedBlocks) as NumPy columns, one row per block.
+
+    Names are interned in `names` and each block keeps its index in `name_index`. `flags` holds the raw Int32sl,
+    -1 for the blocks without flags, and its bit fields are decoded on demand with `flag(name)`. Skins, waypoints
+    and other optional fields are kept aside in `extras` by row.
+
+        table = BlockTable.from_map(data)
+        ground = table[table.where(name="RoadTechStraight", isGround=True)]
+        chunk.blocks = table.to_blocks()
+    """
+
+    def __init__(self, names, name_index, dir, coords, flags, extras=None):
+        self.names = list(names)
+        self.name_index = np.asarray(name_index, dtype=np.int32)
+        self.dir = np.asarray(dir, dtype=np.uint8)
+        self.coords = np.asarray(coords, dtype=np.uint8).reshape(-1, 3)
+        self.flags = np.asarray(flags, dtype=np.int64)
+        self.extras = extras or {}
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        names = {}
+        name_index = np.empty(len(blocks), dtype=np.int32)
+        dir = np.empty(len(blocks), dtype=np.uint8)
+        coords = np.empty((len(blocks), 3), dtype=np.uint8)
+        has_flags = np.ones(len(blocks), dtype=bool)
+        fields = {name: [0] * len(blocks) for name, _, _ in FLAG_FIELDS}
+        extras = {}
+
+        # the only loop over the Containers, item access is much faster than attribute access on them
+        for i, block in enumerate(blocks):
+            name_index[i] = names.setdefault(block["name"], len(names))
+            dir[i] = CARDINAL_DIRS.index(block["dir"])
+            block_coords = block["coords"]
+            coords[i] = (block_coords["x"], block_coords["y"], block_coords["z"])
+            block_flags = block["flags"]
+            if block_flags == -1:
+                has_flags[i] = False
+                continue
+            for name, values in fields.items():
+                values[i] = block_flags[name]
+
+            extra = {key: block[key] for key in EXTRA_FIELDS if block.get(key, None) is not None}
+            if extra:
+                extras[i] = extra
+
+        flags = np.where(has_flags, encode_flags(fields), -1) if len(blocks) else []
+        return cls(names, name_index, dir, coords, flags, extras)
+
+    @classmethod
+    def from_map(cls, data, baked=False):
+        """Blocks (or baked blocks) of a parsed map, None if it has no such chunk"""
+        for chunk in data.body:
+            if chunk.chunkId in BLOCKS_CHUNKS and (chunk.chunkId == 0x03043048) == baked:
+                return cls.from_blocks(chunk.chunk[BLOCKS_CHUNKS[chunk.chunkId]])
+        return None
+
+    @classmethod
+    def concat(cls, tables):
+        """One table of all the blocks of the given tables, names are interned again"""
+        names = {}
+        name_index = []
+        extras = {}
+        offset = 0
+        for table in tables:
+            remap = np.array([names.setdefault(name, len(names)) for name in table.names], dtype=np.int32)
+            name_index.append(remap[table.name_index] if len(remap) else table.name_index)
+            extras.update((offset + row, extra) for row, extra in table.extras.items())
+            offset += len(table)
+
+        return cls(
+            names,
+            np.concatenate(name_index) if name_index else [],
+            np.concatenate([table.dir for table in tables]) if tables else [],
+            np.concatenate([table.coords for table in tables]) if tables else np.empty((0, 3)),
+            np.concatenate([table.flags for table in tables]) if tables else [],
+            extras,
+        )
+
+    def to_blocks(self):
+        """Blocks as parsed, to be set back in their chunk"""
+        # python lists, indexing numpy arrays one item at a time is slow
+        fields = [
+            (name, [bool(value) for value in values] if size == 1 else values.tolist())
+            for (name, _, size), values in zip(reversed(FLAG_FIELDS), reversed(self.flag_fields().values()))
+        ]
+        names = [self.names[index] for index in self.name_index.tolist()]
+        dirs = [CARDINAL_DIRS[dir] for dir in self.dir.tolist()]
+        coords = self.coords.tolist()
+        has_flags = self.has_flags.tolist()
+
+        blocks = ListContainer()
+        for i in range(len(self)):
+            x, y, z = coords[i]
+            block = Container(name=names[i], dir=dirs[i], coords=Container(x=x, y=y, z=z))
+            if not has_flags[i]:
+                block.flags = -1
+                blocks.append(block)
+                continue
+
+            block.flags = Container((name, values[i]) for name, values in fields)
+            extra = self.extras.get(i, {})
+            for key in EXTRA_FIELDS:
+                block[key] = extra.get(key, None)
+            blocks.append(block)
+        return blocks
+
+    def __len__(self):
+        return len(self.name_index)
+
+    def __getitem__(self, rows):
+        """Sub table of the given rows (index array, slice or boolean mask), names are kept as they are"""
+        rows = np.arange(len(self))[rows]
+        old_rows = {old: new for new, old in enumerate(rows.tolist())}
+        return BlockTable(
+            self.names,
+            self.name_index[rows],
+            self.dir[rows],
+            self.coords[rows],
+            self.flags[rows],
+            {old_rows[row]: extra for row, extra in self.extras.items() if row in old_rows},
+        )
+
+    @property
+    def has_flags(self):
+        return self.flags != -1
+
+    @property
+    def block_names(self):
+        return np.array(self.names, dtype=object)[self.name_index]
+
+    def flag(self, name):
+        shift, size = FLAG_BITS[name]
+        values = ((self.flags & 0xFFFFFFFF) >> shift) & ((1 << size) - 1)
+        return values.astype(bool) if size == 1 else values.astype(np.uint8)
+
+    def flag_fields(self):
+        return decode_flags(self.flags)
+
+    def set_flag(self, name, values, rows=None):
+        """Sets a bit field of the blocks with flags, all of them or only the given rows.
+        values is a scalar or has one value per block of the table."""
+        shift, size = FLAG_BITS[name]
+        mask = ((1 << size) - 1) << shift
+        selected = self.has_flags
+        if rows is not None:
+            in_rows = np.zeros(len(self), dtype=bool)
+            in_rows[rows] = True
+            selected &= in_rows
+
+        new_flags = (self.flags & 0xFFFFFFFF & ~mask) | ((np.asarray(values, dtype=np.int64) << shift) & mask)
+        new_flags = np.where(new_flags >= 1 << 31, new_flags - (1 << 32), new_flags)
+        self.flags = np.where(selected, new_flags, self.flags)
+
+    def where(self, name=None, names=None, dir=None, min_coords=None, max_coords=None, **flags):
+        """Boolean mask of the blocks matching all the given conditions.
+        name is a prefix of the block name, names a list of exact names, coords bounds are inclusive."""
+        mask = np.ones(len(self), dtype=bool)
+        if name is not None:
+            matching = [i for i, block_name in enumerate(self.names) if block_name.startswith(name)]
+            mask &= np.isin(self.name_index, matching)
+        if names is not None:
+            matching = [i for i, block_name in enumerate(self.names) if block_name in set(names)]
+            mask &= np.isin(self.name_index, matching)
+        if dir is not None:
+            mask &= self.dir == (CARDINAL_DIRS.index(dir) if isinstance(dir, str) else dir)
+        if min_coords is not None:
+            mask &= np.all(self.coords >= np.asarray(min_coords), axis=1)
+        if max_coords is not None:
+            mask &= np.all(self.coords <= np.asarray(max_coords), axis=1)
+        if flags:
+            mask &= self.has_flags
+            for flag_name, value in flags.items():
+                mask &= self.flag(flag_name) == value
+        return mask
+
+    def counts(self):
+        """Number of blocks of each name"""
+        counts = np.bincount(self.name_index, minlength=len(self.names))
+        return {name: int(count) for name, count in zip(self.names, counts) if count}
@@ -16,7 +16,7 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Slot, QSize, Qt
 from PySide6.QtGui import QTextCursor
 
-from src.gbx_structs import GbxPose3D, GbxStruct, GbxStructWithoutBodyParsed
+from src.gbx_structs import GbxPose3D, GbxStruct, GbxStructWithoutBodyParsed, GbxLazyValue
 from construct import (
     Container,
     ListContainer,
@@ -44,6 +44,9 @@ class QTreeWidgetItem_WithData(QTreeWidgetItem):
 
 
 def tree_widget_item(key, value):
+    if isinstance(value, GbxLazyValue):
+        value = value.value
+
     if isinstance(value, Container):
         item = QTreeWidgetItem([key])
         for child in container_iter(value):
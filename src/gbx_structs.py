@@ -2,14 +2,30 @@ from functools import partial
 import datetime
 import string
 
-import lzo
+try:
+    import lzo
+except ImportError:
+    # python-lzo has no wheel for some platforms, mini_lzo is a much slower pure python port
+    lzo = None
 import src.mini_lzo
 import zlib
 import zipfile
 import io
 
+import numpy as np
+
 from construct import *
-from src.my_construct import MyRepeatUntil
+from src.my_construct import (
+    MyRepeatUntil,
+    BytesUntil,
+    CompilableAdapter,
+    NumpyArray,
+    PrefixedNumpyArray,
+    compile_construct,
+    construct_children,
+    stream_read_view,
+    to_numpy_array,
+)
 
 from src.gbx_enums import *
 
@@ -19,31 +35,164 @@ GbxCompressedBody = Struct(
 )
 
 
-class CompressedLZ0(Tunnel):
-    def _decode(self, raw_bytes, context, path):
-        data = GbxCompressedBody.parse(raw_bytes)
+def lzo_decompress(compressed_body, uncompressed_size):
+    if lzo is None:
+        return src.mini_lzo.decompress(compressed_body, uncompressed_size)
+    return lzo.decompress(compressed_body, False, uncompressed_size)
 
-        return lzo.decompress(data.compressed_body, False, data.uncompressed_size)
 
-        # return mini_lzo.decompress(data.compressed_body, data.uncompressed_size)
+class LzoCompression:
+    """How built bodies are compressed. Level 1 is LZO1X-1, levels 2 to 9 are LZO1X-999 which is the smallest
+    (the game's own files) but several times slower. mini_lzo only implements LZO1X-1 and ignores the level.
 
-    def _encode(self, raw_bytes, context, path):
-        return GbxCompressedBody.build(
-            Container(
-                uncompressed_size=len(raw_bytes),
-                # compressed_body=mini_lzo.compress(raw_bytes),
-                compressed_body=lzo.compress(raw_bytes, 9, False),
-            )
-        )
+    Set for all builds with set_lzo_compression, or for one build with GbxStruct.build(..., compression=LZO_FAST)."""
+
+    def __init__(self, level=9):
+        if not 1 <= level <= 9:
+            raise ValueError(f"LZO compression level must be between 1 and 9, got {level}")
+        self.level = level
+
+    def compress(self, body):
+        if lzo is None:
+            return src.mini_lzo.compress(body)
+        return lzo.compress(body, self.level, False)
+
+    def __repr__(self):
+        return f"LzoCompression(level={self.level})"
+
+
+LZO_FAST = LzoCompression(1)
+LZO_BEST = LzoCompression(9)
+
+lzo_compression = LZO_BEST
+
+
+def set_lzo_compression(compression):
+    global lzo_compression
+    lzo_compression = compression
+
+
+class CompressedLZ0(Subconstruct):
+    """Same layout as GbxCompressedBody. The compressed bytes are decompressed straight from the parsed buffer
+    and the built body is compressed from the buffer it was built into, without intermediate copies."""
+
+    def _parse(self, stream, context, path):
+        uncompressed_size = Int32ul._parsereport(stream, context, path)
+        compressed_size = Int32ul._parsereport(stream, context, path)
+        compressed_body = stream_read_view(stream, compressed_size, path)
+
+        body = lzo_decompress(compressed_body, uncompressed_size)
+
+        # a BytesIO shares the bytes it is given
+        return self.subcon._parsereport(io.BytesIO(body), context, path)
+
+    def _build(self, obj, stream, context, path):
+        body = io.BytesIO()
+        buildret = self.subcon._build(obj, body, context, path)
+
+        body_view = body.getbuffer().toreadonly()
+        compression = context._params.get("compression", None) or lzo_compression
+        compressed_body = compression.compress(body_view)
+
+        Int32ul._build(len(body_view), stream, context, path)
+        Int32ul._build(len(compressed_body), stream, context, path)
+        stream_write(stream, compressed_body, len(compressed_body), path)
+        return buildret
+
+    def _sizeof(self, context, path):
+        raise SizeofError(path=path)
+
+
+class GbxZipArchive:
+    """Embedded zip kept as its original bytes. The central directory is only read on first access and each member
+    is only inflated when read. Unless writer() was called, the original bytes are built back as they are."""
+
+    __slots__ = ("raw", "_reader", "_writer", "_buffer")
+
+    def __init__(self, raw):
+        self.raw = bytes(raw)
+        self._reader = None
+        self._writer = None
+        self._buffer = None
 
+    @property
+    def reader(self):
+        if self._writer is not None:
+            return self._writer
+        if self._reader is None:
+            self._reader = zipfile.ZipFile(io.BytesIO(self.raw), "r")
+        return self._reader
 
-class ACompressedZip(Adapter):
+    def writer(self):
+        """ZipFile in append mode over a copy of the bytes, its changes are written when building"""
+        if self._writer is None:
+            self._buffer = io.BytesIO(self.raw)
+            self._writer = zipfile.ZipFile(self._buffer, "a", compression=zipfile.ZIP_DEFLATED)
+            self._reader = None
+        return self._writer
+
+    def getvalue(self):
+        if self._writer is not None:
+            # the central directory is only written on close
+            self._writer.close()
+            self.raw = self._buffer.getvalue()
+            self._writer = None
+            self._buffer = None
+        return self.raw
+
+    @property
+    def modified(self):
+        return self._writer is not None
+
+    def namelist(self):
+        return self.reader.namelist()
+
+    def infolist(self):
+        return self.reader.infolist()
+
+    def getinfo(self, name):
+        return self.reader.getinfo(name)
+
+    def read(self, name):
+        return self.reader.read(name)
+
+    def open(self, name):
+        return self.reader.open(name)
+
+    def extract(self, name, path=None):
+        return self.reader.extract(name, path)
+
+    def extractall(self, path=None, members=None):
+        self.reader.extractall(path, members)
+
+    def __contains__(self, name):
+        return name in self.reader.NameToInfo
+
+    def __iter__(self):
+        return iter(self.namelist())
+
+    def __len__(self):
+        return len(self.reader.filelist)
+
+    def __eq__(self, other):
+        return isinstance(other, GbxZipArchive) and self.getvalue() == other.getvalue()
+
+    def __getstate__(self):
+        return self.getvalue()
+
+    def __setstate__(self, raw):
+        GbxZipArchive.__init__(self, raw)
+
+    def __repr__(self):
+        return f"<GbxZipArchive {len(self.raw)} bytes{', modified' if self.modified else ''}>"
+
+
+class ACompressedZip(CompilableAdapter):
     def _decode(self, raw_bytes, context, path):
-        self.buffer = io.BytesIO(raw_bytes)
-        return zipfile.ZipFile(self.buffer, "a", compression=zipfile.ZIP_DEFLATED)
+        return GbxZipArchive(raw_bytes)
 
-    def _encode(self, zip, context, path):
-        return self.buffer.getvalue()
+    def _encode(self, archive, context, path):
+        return archive.getvalue()
 
 
 GbxCompressedZip = ACompressedZip(Prefixed(Int32ul, GreedyBytes))
@@ -175,19 +324,7 @@ GbxPlugSurfaceMaterialId = Struct(
     "gameplayId" / GbxEPlugSurfaceGameplayId,
 )
 
-GbxBytesUntilFacade = Struct(
-    "bytes_until_facade"
-    / IfThenElse(
-        lambda this: this._building,
-        GreedyBytes,
-        ExprAdapter(
-            RepeatUntil(lambda x, lst, ctx: lst[-4:] == [0x01, 0xDE, 0xCA, 0xFA], Byte),
-            lambda obj, ctx: bytes(obj[:-4]),
-            lambda obj, ctx: GreedyBytes.build(obj + b"\x01\xDE\xCA\xFA"),
-        ),
-    ),
-    Seek(-4, 1),
-)
+GbxBytesUntilFacade = Struct("bytes_until_facade" / BytesUntil(b"\x01\xDE\xCA\xFA"))
 
 
 def tenb_to_float(x):
@@ -204,7 +341,7 @@ def float_to_tenb(x):
     return x
 
 
-class AGbxDec3N(Adapter):
+class AGbxDec3N(CompilableAdapter):
     def _decode(self, obj, ctx, path):
         return Container(
             x=tenb_to_float(obj & 0x3FF),
@@ -218,8 +355,40 @@ class AGbxDec3N(Adapter):
 
 GbxDec3N = AGbxDec3N(Int32ul)
 
+GbxVec2Dtype = np.dtype([("x", "<f4"), ("y", "<f4")])
+GbxVec3Dtype = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+GbxVec4Dtype = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("w", "<f4")])
+GbxColorDtype = np.dtype([("b", "u1"), ("g", "u1"), ("r", "u1"), ("a", "u1")])
+GbxDec3NDtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+
+
+class AGbxDec3NArray(CompilableAdapter):
+    """Same as GbxDec3N[count] but vectorized, decoded as a record array"""
 
-class AGbxUDec4N(Adapter):
+    def _decode(self, obj, ctx, path):
+        res = np.recarray(len(obj), dtype=GbxDec3NDtype)
+        for name, shift in (("x", 0), ("y", 10), ("z", 20)):
+            x = ((obj >> shift) & 0x3FF).astype(np.int64)
+            x[x >= 0x201] -= 0x400
+            res[name] = x / 0x1FF
+        return res
+
+    def _encode(self, obj, ctx, path):
+        obj = to_numpy_array(obj, GbxDec3NDtype)
+        res = np.zeros(len(obj), dtype="<u4")
+        for name, shift in (("x", 0), ("y", 10), ("z", 20)):
+            # astype truncates toward zero like int() in float_to_tenb
+            x = (np.clip(obj[name], -1, 1) * 0x1FF).astype(np.int64)
+            x[x < 0] += 0x400
+            res |= x.astype("<u4") << shift
+        return res
+
+
+def GbxDec3NArray(count):
+    return AGbxDec3NArray(NumpyArray(count, "<u4"))
+
+
+class AGbxUDec4N(CompilableAdapter):
     def _decode(self, obj, ctx, path):
         return Container(
             x=((obj >> 0x10) & 0xFF) * 0.003921569,
@@ -276,7 +445,7 @@ GbxIso4 = Struct(
 GbxInt3 = Struct("x" / Int32sl, "y" / Int32sl, "z" / Int32sl)
 
 
-class AGbxFileTime(Adapter):
+class AGbxFileTime(CompilableAdapter):
     EPOCH_START = datetime.datetime(1601, 1, 1)
 
     def _decode(self, file_time, context, path):
@@ -443,6 +612,35 @@ class GbxLookbackStringContext(Construct):
     def _sizeof(self, context, path):
         return self.subcon._sizeof(context, path)
 
+    def _emitparse(self, code):
+        code.append(LOOKBACKSTRING_CONTEXT_CODE)
+        return f"lookbackstring_context(this, lambda: {self.subcon._compileparse(code)})"
+
+    def _emitbuild(self, code):
+        code.append(LOOKBACKSTRING_CONTEXT_CODE)
+        return f"lookbackstring_context(this, lambda: {self.subcon._compilebuild(code)})"
+
+
+LOOKBACKSTRING_CONTEXT_CODE = """
+    def lookbackstring_context(this, func):
+        gbx_data = this['_root']['_params']['gbx_data']
+        old_table = gbx_data.pop("lookbackstring_table", None)
+        old_index = gbx_data.pop("lookbackstring_index", None)
+        old_version = gbx_data.pop("lookbackstring_version", None)
+
+        gbx_data["lookbackstring_table"] = {}
+        gbx_data["lookbackstring_index"] = 0
+        gbx_data["lookbackstring_version"] = False
+
+        res = func()
+
+        gbx_data["lookbackstring_table"] = old_table
+        gbx_data["lookbackstring_index"] = old_index
+        gbx_data["lookbackstring_version"] = old_version
+
+        return res
+"""
+
 
 GbxMeta = Struct(
     "id" / GbxLookbackString,
@@ -488,6 +686,43 @@ class GbxOptimizedInt(Construct):
 
         return struct._sizeof(context, path)
 
+    def _emitparse(self, code):
+        code.append(OPTIMIZED_INT_CODE)
+        return f"parse_optimizedint(io, {repr(self.size_func)})"
+
+    def _emitbuild(self, code):
+        code.append(OPTIMIZED_INT_CODE)
+        return f"build_optimizedint(obj, io, {repr(self.size_func)})"
+
+
+OPTIMIZED_INT_CODE = """
+    def optimizedint_format(max_size):
+        if max_size < 2**8:
+            return "B"
+        elif max_size < 2**16:
+            return "H"
+        else:
+            return "I"
+
+    def parse_optimizedint(io, max_size):
+        fmt = "<" + optimizedint_format(max_size)
+        return struct.unpack(fmt, io.read(struct.calcsize(fmt)))[0]
+
+    def build_optimizedint(obj, io, max_size):
+        io.write(struct.pack("<" + optimizedint_format(max_size), obj))
+        return obj
+
+    def parse_optimizedintarray(io, length, max_size):
+        fmt = f"<{length}{optimizedint_format(max_size)}"
+        return ListContainer(struct.unpack(fmt, io.read(struct.calcsize(fmt))))
+
+    def build_optimizedintarray(obj, io, length, max_size):
+        if len(obj) != length:
+            raise RangeError(f"expected {length} elements, found {len(obj)}")
+        io.write(struct.pack(f"<{length}{optimizedint_format(max_size)}", *obj))
+        return obj
+"""
+
 
 class GbxOptimizedIntArray(Construct):
     def __init__(self, length_func=None, size_func=None):
@@ -535,6 +770,498 @@ class GbxOptimizedIntArray(Construct):
 
         return struct._sizeof(context, path) * length
 
+    def _emitparse(self, code):
+        code.append(OPTIMIZED_INT_CODE)
+        length = repr(self.length_func)
+        max_size = length if self.size_func is None else repr(self.size_func)
+        return f"parse_optimizedintarray(io, {length}, {max_size})"
+
+    def _emitbuild(self, code):
+        code.append(OPTIMIZED_INT_CODE)
+        length = repr(self.length_func)
+        max_size = length if self.size_func is None else repr(self.size_func)
+        return f"build_optimizedintarray(obj, io, {length}, {max_size})"
+
+
+class GbxLazyValue:
+    """Skippable chunk kept as raw bytes, decoded on first access."""
+
+    __slots__ = ("chunkId", "offset", "raw", "_subcon", "_context", "_gbx_data", "_path", "_value", "_decoded")
+
+    def __init__(self, subcon, raw, offset, context, path):
+        chunk_context = context
+        while "chunkId" not in chunk_context and chunk_context.get("_") is not None:
+            chunk_context = chunk_context._
+        self.chunkId = chunk_context.get("chunkId", None)
+        self.offset = offset
+        self.raw = raw
+        self._subcon = subcon
+        self._context = context
+        self._gbx_data = {
+            k: dict(v) if isinstance(v, dict) else v for k, v in context._root._params.gbx_data.items()
+        }
+        self._path = path
+        self._value = None
+        self._decoded = False
+
+    @property
+    def decoded(self):
+        return self._decoded
+
+    @property
+    def value(self):
+        if not self._decoded:
+            context = self._context
+            params = Container(context._root._params)
+            params.gbx_data = {k: dict(v) if isinstance(v, dict) else v for k, v in self._gbx_data.items()}
+            ctx = Container(context)
+            ctx._params = params
+            ctx._root = Container(context._root)
+            ctx._root._params = params
+
+            self._value = self._subcon._parsereport(io.BytesIO(self.raw), ctx, self._path)
+            self._decoded = True
+            self._context = None
+        return self._value
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in GbxLazyValue.__slots__:
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __setattr__(self, name, value):
+        if name in GbxLazyValue.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.value, name, value)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __setitem__(self, key, value):
+        self.value[key] = value
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, GbxLazyValue):
+            other = other.value
+        return self.value == other
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+
+        if self._decoded:
+            return deepcopy(self._value, memo)
+
+        # still undecoded: only the raw bytes and the subcon are shared, each copy decodes its own value
+        copied = object.__new__(GbxLazyValue)
+        for name in ("chunkId", "offset", "raw", "_subcon", "_path", "_value", "_decoded"):
+            object.__setattr__(copied, name, getattr(self, name))
+        object.__setattr__(copied, "_context", Container(self._context))
+        object.__setattr__(
+            copied, "_gbx_data", {k: dict(v) if isinstance(v, dict) else v for k, v in self._gbx_data.items()}
+        )
+        memo[id(self)] = copied
+        return copied
+
+    def __reduce__(self):
+        # the parse context cannot be pickled, the decoded value is
+        return decoded_lazy_value, (self.value,)
+
+    def __repr__(self):
+        if self._decoded:
+            return repr(self._value)
+        return f"<GbxLazyValue {'None' if self.chunkId is None else hex(self.chunkId)}, {len(self.raw)} bytes>"
+
+    __str__ = __repr__
+
+
+def decoded_lazy_value(value):
+    return value
+
+
+def _uses_shared_state(sc, isolated_lookback, seen):
+    """Whether parsing sc can read or write the node table or the outer lookback strings."""
+    if (id(sc), isolated_lookback) in seen:
+        return False
+    seen.add((id(sc), isolated_lookback))
+
+    if isinstance(sc, (GbxNodeRefAdapter, LazyBound)):
+        return True
+    if sc is GbxLookbackString and not isolated_lookback:
+        return True
+    if isinstance(sc, GbxLookbackStringContext):
+        isolated_lookback = True
+
+    return any(_uses_shared_state(child, isolated_lookback, seen) for child in construct_children(sc))
+
+
+context_free_chunks = {}
+
+
+def is_context_free_chunk(chunkId):
+    """Whether the bytes of a chunk depend only on its own fields. Unknown chunks are kept as bytes, so they are."""
+    if chunkId not in context_free_chunks:
+        subcon = interpreted_body_chunks.get(chunkId, body_chunks.get(chunkId))
+        context_free_chunks[chunkId] = subcon is None or not _uses_shared_state(subcon, False, set())
+    return context_free_chunks[chunkId]
+
+
+def is_lazy_chunk(chunkId):
+    """A skippable chunk can be deferred only if it does not touch state shared with the following chunks."""
+    return chunkId in body_chunks and is_context_free_chunk(chunkId)
+
+
+class GbxLazyChunk(Subconstruct):
+    """Defers the parsing of a skippable chunk when parsed with lazy=True."""
+
+    def _parse(self, stream, context, path):
+        if context._root._params.get("lazy", False) and is_lazy_chunk(context.chunkId):
+            offset = stream_tell(stream, path)
+            return GbxLazyValue(self.subcon, stream_read_entire(stream, path), offset, context, path)
+        return self.subcon._parsereport(stream, context, path)
+
+    def _build(self, obj, stream, context, path):
+        if isinstance(obj, GbxLazyValue):
+            if not obj.decoded:
+                stream_write(stream, obj.raw, len(obj.raw), path)
+                return obj
+            obj = obj.value
+        return self.subcon._build(obj, stream, context, path)
+
+
+class GbxDeferredZLib(Subconstruct):
+    """CompressedZLib kept compressed, it is only inflated and parsed on access (GbxLazyValue).
+    Untouched, the original compressed bytes are written back."""
+
+    def __init__(self, subcon):
+        super().__init__(CompressedZLib(subcon))
+
+    def _parse(self, stream, context, path):
+        offset = stream_tell(stream, path)
+        stream_seek(stream, 4, 1, path)
+        compressed_size = Int32ul._parsereport(stream, context, path)
+        stream_seek(stream, offset, 0, path)
+        raw = stream_read(stream, 8 + compressed_size, path)
+        return GbxLazyValue(self.subcon, raw, offset, context, path)
+
+    def _build(self, obj, stream, context, path):
+        if isinstance(obj, GbxLazyValue):
+            if not obj.decoded:
+                stream_write(stream, obj.raw, len(obj.raw), path)
+                return obj
+            obj = obj.value
+        return self.subcon._build(obj, stream, context, path)
+
+
+class GbxSpan:
+    """Raw bytes of a chunk parsed with incremental=True, and the parse state they depend on:
+    the lookback strings before and after (prefix tuples of the table) and the node refs read, in order."""
+
+    __slots__ = ("source", "start", "end", "touched", "lookback", "noderefs")
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.touched = False
+        self.lookback = None
+        self.noderefs = ()
+
+    @property
+    def raw(self):
+        return self.source[self.start : self.end]
+
+
+UNTRACKED_CHUNK_KEYS = ("chunkId", "skippable")
+
+
+class GbxChunk(Container):
+    """Body chunk parsed with incremental=True. Any access to its fields (even a read) marks it as touched,
+    an untouched chunk is built by copying its raw bytes."""
+
+    @classmethod
+    def from_span(cls, obj, span):
+        chunk = cls(dict.items(obj))
+        chunk.__dict__["span"] = span
+        return chunk
+
+    def touch(self):
+        span = self.__dict__.get("span", None)
+        if span is not None:
+            span.touched = True
+
+    def untracked(self):
+        return Container(dict.items(self))
+
+    def __getattr__(self, name):
+        # copy and pickle look for special methods, they are not fields
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return super().__getattr__(name)
+
+    def __getitem__(self, key):
+        if key not in UNTRACKED_CHUNK_KEYS:
+            self.touch()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key not in UNTRACKED_CHUNK_KEYS:
+            self.touch()
+        return super().get(key, default)
+
+    def __setitem__(self, key, value):
+        self.touch()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.touch()
+        super().__delitem__(key)
+
+    def pop(self, *args):
+        self.touch()
+        return super().pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self.touch()
+        return super().popitem(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self.touch()
+        return super().setdefault(key, default)
+
+    def clear(self):
+        self.touch()
+        super().clear()
+
+    def items(self):
+        self.touch()
+        return super().items()
+
+    def values(self):
+        self.touch()
+        return super().values()
+
+    def __eq__(self, other):
+        if isinstance(other, GbxChunk):
+            other = other.untracked()
+        return self.untracked() == other
+
+    def __repr__(self):
+        return repr(self.untracked())
+
+    def __str__(self):
+        return str(self.untracked())
+
+    # pickle and deepcopy keep the span without touching the chunk
+    def __getstate__(self):
+        return Container(dict.items(self)), self.__dict__.get("span", None)
+
+    def __setstate__(self, state):
+        fields, span = state
+        Container.__setstate__(self, fields)
+        self.__dict__["span"] = span
+
+    def __reduce__(self):
+        return (self.__class__, (), self.__getstate__())
+
+
+def lookback_prefix(gbx_data):
+    """Strings of the current lookback table while parsing, as a tuple shared until a new string is read."""
+    table = gbx_data.get("lookbackstring_table", None)
+    if table is None:
+        return ()
+
+    prefixes = gbx_data.setdefault("incremental_prefixes", {})
+    entry = prefixes.get(id(table), None)
+    prefix = entry[1] if entry is not None and entry[0] is table else ()
+    index = gbx_data["lookbackstring_index"]
+    if len(prefix) != index:
+        prefix += tuple(table[i] for i in range(len(prefix) + 1, index + 1))
+        prefixes[id(table)] = (table, prefix)
+    return prefix
+
+
+def lookback_matches(gbx_data, prefix):
+    """Whether the lookback table being built holds the same strings, at the same indices, as prefix."""
+    table = gbx_data.get("lookbackstring_table", None)
+    if table is None or gbx_data["lookbackstring_index"] != len(prefix):
+        return False
+    if not prefix:
+        return True
+
+    verified = gbx_data.setdefault("incremental_lookback", {})
+    entry = verified.get(id(table), None)
+    if entry is None or entry[0] is not table or (entry[1] is not prefix and entry[1] != prefix):
+        if any(table.get(string, None) != index for index, string in enumerate(prefix, 1)):
+            return False
+        verified[id(table)] = (table, prefix)
+    return True
+
+
+def node_unchanged(node, body, classId):
+    if body is None or not isinstance(node, dict) or node.get("classId", None) != classId:
+        return False
+    current = node.get("body", None)
+    return (
+        isinstance(current, list)
+        and len(current) == len(body)
+        and all(a is b and not a.__dict__["span"].touched for a, b in zip(current, body))
+    )
+
+
+class GbxIncremental(Subconstruct):
+    """With incremental=True, keeps the raw bytes of each body chunk.
+
+    An untouched chunk is built by copying them back if the lookback strings and the nodes it refers to are in
+    the same state as when it was parsed, otherwise (or with incremental=False at build) it is built again."""
+
+    def _parse(self, stream, context, path):
+        params = context._root._params
+        if not params.get("incremental", False):
+            return self.subcon._parsereport(stream, context, path)
+
+        gbx_data = params.gbx_data
+        noderefs = gbx_data.setdefault("incremental_noderefs", [])
+        first_noderef = len(noderefs)
+        prefix_before = lookback_prefix(gbx_data)
+        version_before = gbx_data.get("lookbackstring_version", None)
+
+        start = stream_tell(stream, path)
+        obj = self.subcon._parsereport(stream, context, path)
+        end = stream_tell(stream, path)
+
+        if isinstance(stream, io.BytesIO):
+            # the BytesIO shares its buffer, nothing is copied
+            span = GbxSpan(stream.getvalue(), start, end)
+        else:
+            stream_seek(stream, start, 0, path)
+            span = GbxSpan(stream_read(stream, end - start, path), 0, end - start)
+
+        if not is_context_free_chunk(obj.get("chunkId", None)):
+            span.lookback = (
+                prefix_before,
+                lookback_prefix(gbx_data),
+                version_before,
+                gbx_data.get("lookbackstring_version", None),
+            )
+            span.noderefs = tuple(noderefs[first_noderef:])
+
+        return GbxChunk.from_span(obj, span)
+
+    def _build(self, obj, stream, context, path):
+        span = obj.__dict__.get("span", None) if isinstance(obj, GbxChunk) else None
+        if span is None:
+            return self.subcon._build(obj, stream, context, path)
+
+        if not span.touched and context._root._params.get("incremental", True) and self.can_copy(span, context):
+            raw = span.raw
+            stream_write(stream, raw, len(raw), path)
+            self.apply_state(span, context)
+            return obj
+
+        return self.subcon._build(obj.untracked(), stream, context, path)
+
+    def can_copy(self, span, context):
+        if span.lookback is None:
+            return True
+
+        gbx_data = context._root._params.gbx_data
+        prefix_before, _, version_before, _ = span.lookback
+        if gbx_data.get("lookbackstring_version", None) != version_before or not lookback_matches(
+            gbx_data, prefix_before
+        ):
+            return False
+
+        if not span.noderefs:
+            return True
+        if get_noderef_offset(Container(_=context)) != 0:
+            return False
+
+        # same node refs as parsed: back refs to nodes already written, and the same unmodified nodes to write
+        nodes = context._root._params.nodes
+        written = set()
+        for index, node, body, classId in span.noderefs:
+            if not 0 <= index < len(nodes):
+                return False
+            if node is None:
+                if nodes[index] is not None and index not in written:
+                    return False
+            elif nodes[index] is not node or index in written or not node_unchanged(node, body, classId):
+                return False
+            else:
+                written.add(index)
+        return True
+
+    def apply_state(self, span, context):
+        """What building the chunk would have done to the lookback table and the node table."""
+        if span.lookback is None:
+            return
+
+        gbx_data = context._root._params.gbx_data
+        prefix_before, prefix_after, _, version_after = span.lookback
+        table = gbx_data["lookbackstring_table"]
+        for index, string in enumerate(prefix_after[len(prefix_before) :], len(prefix_before) + 1):
+            table.setdefault(string, index)
+        gbx_data["lookbackstring_index"] = len(prefix_after)
+        gbx_data["lookbackstring_version"] = version_after
+        gbx_data.setdefault("incremental_lookback", {})[id(table)] = (table, prefix_after)
+
+        nodes = context._root._params.nodes
+        for index, node, _, _ in span.noderefs:
+            if node is not None:
+                nodes[index] = None
+
+
+class GbxProfiled(Subconstruct):
+    """Reports each chunk or node to the profiler given with profiler=Profiler(), does nothing otherwise.
+    The id (chunk id or class id) is the first field of subcon."""
+
+    def __init__(self, kind, subcon):
+        super().__init__(subcon)
+        self.kind = kind
+
+    def _parse(self, stream, context, path):
+        profiler = context._root._params.get("profiler", None)
+        if profiler is None:
+            return self.subcon._parsereport(stream, context, path)
+
+        offset = stream_tell(stream, path)
+        id_bytes = stream.read(4)
+        stream_seek(stream, offset, 0, path)
+
+        profiler.enter(self.kind, int.from_bytes(id_bytes, "little") if len(id_bytes) == 4 else None)
+        size = 0
+        try:
+            obj = self.subcon._parsereport(stream, context, path)
+            size = stream_tell(stream, path) - offset
+        finally:
+            profiler.leave("parse", size)
+        return obj
+
+    def _build(self, obj, stream, context, path):
+        profiler = context._root._params.get("profiler", None)
+        if profiler is None:
+            return self.subcon._build(obj, stream, context, path)
+
+        offset = stream_tell(stream, path)
+        profiler.enter(self.kind, obj.get("chunkId" if self.kind == "chunk" else "classId", None))
+        size = 0
+        try:
+            buildret = self.subcon._build(obj, stream, context, path)
+            size = stream_tell(stream, path) - offset
+        finally:
+            profiler.leave("build", size)
+        return buildret
+
 
 body_chunks = {}
 
@@ -573,40 +1300,47 @@ def print_chunk_fail(obj, ctx):
 
 GbxBodyChunks = MyRepeatUntil(
     lambda obj, lst, ctx: obj is None or "rest" in obj or obj.chunkId == 0xFACADE01,
-    Select(
-        Struct(
-            "chunkId" / ExprValidator(GbxChunkId, obj_ == 0xFACADE01),
-        ),
-        Struct(
-            "chunkId" / GbxChunkId,
-            "skippable" / ExprValidator(Const(b"PIKS"), obj_ == b"PIKS"),
-            "chunk"
-            / Prefixed(
-                Int32ul,
-                Select(
-                    Switch(
+    GbxProfiled(
+        "chunk",
+        GbxIncremental(
+            Select(
+                Struct(
+                    "chunkId" / ExprValidator(GbxChunkId, obj_ == 0xFACADE01),
+                ),
+                Struct(
+                    "chunkId" / GbxChunkId,
+                    "skippable" / ExprValidator(Const(b"PIKS"), obj_ == b"PIKS"),
+                    "chunk"
+                    / Prefixed(
+                        Int32ul,
+                        GbxLazyChunk(
+                            Select(
+                                Switch(
+                                    this.chunkId,
+                                    body_chunks,
+                                    default=GreedyBytes,
+                                ),
+                                Struct("_chunkParseFailed" / GreedyBytes * print_chunk_fail),
+                            ),
+                        ),
+                    ),
+                ),
+                Struct(
+                    "chunkId" / GbxChunkId,
+                    "chunk"
+                    / Switch(
                         this.chunkId,
                         body_chunks,
-                        default=GreedyBytes,
+                        default=Struct("_unknownChunkId" / GbxBytesUntilFacade * print_chunk_unknown),
                     ),
-                    Struct("_chunkParseFailed" / GreedyBytes * print_chunk_fail),
                 ),
+                Struct(
+                    "chunkId" / GbxChunkId,
+                    "chunk" / Struct("_chunkParseFailed" / GreedyBytes * print_chunk_fail),
+                ),
+                Struct("rest" / GreedyBytes),
             ),
         ),
-        Struct(
-            "chunkId" / GbxChunkId,
-            "chunk"
-            / Switch(
-                this.chunkId,
-                body_chunks,
-                default=Struct("_unknownChunkId" / GbxBytesUntilFacade * print_chunk_unknown),
-            ),
-        ),
-        Struct(
-            "chunkId" / GbxChunkId,
-            "chunk" / Struct("_chunkParseFailed" / GreedyBytes * print_chunk_fail),
-        ),
-        Struct("rest" / GreedyBytes),
     ),
 )
 
@@ -657,7 +1391,7 @@ def get_noderef_offset(ctx):
     return 0
 
 
-class GbxNodeRefAdapter(Adapter):
+class GbxNodeRefAdapter(CompilableAdapter):
     def _decode(self, obj, ctx, path):
         if obj.index == -1:
             return TGbxNodeRef(-1)
@@ -667,6 +1401,15 @@ class GbxNodeRefAdapter(Adapter):
             # print(f"parsed {obj.index} {path}")
             ctx._root._params.nodes[obj.index] = obj.internal_node
 
+        noderefs = ctx._root._params.gbx_data.get("incremental_noderefs", None)
+        if noderefs is not None:
+            node = obj.internal_node
+            if node is None:
+                noderefs.append((obj.index, None, None, None))
+            else:
+                body = node.get("body", None)
+                noderefs.append((obj.index, node, tuple(body) if isinstance(body, list) else None, node.classId))
+
         return TGbxNodeRef(obj.index)
 
     def _encode(self, obj, ctx, path):
@@ -695,7 +1438,7 @@ GbxNodeRef = GbxNodeRefAdapter(
         "internal_node"
         / If(
             need_node_body,
-            Struct("classId" / GbxChunkId, "body" / GbxBody),
+            GbxProfiled("node", Struct("classId" / GbxChunkId, "body" / GbxBody)),
         ),
     ),
 )
@@ -923,13 +1666,58 @@ body_chunks[0x03043029] = Struct(
 body_chunks[0x0304302A] = Struct(
     "u01" / GbxBool,
 )
+class GbxAnchoredObjects(Subconstruct):
+    """Parsed as an ItemTable (src.item_table) with columnar=True, most items are then read and written straight
+    from the bytes. A list of nodes is built as usual."""
+
+    def __init__(self, node_struct):
+        super().__init__(PrefixedArray(Int32ul, node_struct))
+        self.node_struct = node_struct
+
+    def _parse(self, stream, context, path):
+        if not context._root._params.get("columnar", False) or not isinstance(stream, io.BytesIO):
+            return self.subcon._parsereport(stream, context, path)
+
+        from src.item_table import ItemTable
+
+        count = Int32ul._parsereport(stream, context, path)
+
+        def parse_node(pos):
+            stream_seek(stream, pos, 0, path)
+            node = self.node_struct._parsereport(stream, context, path)
+            return node, stream_tell(stream, path)
+
+        # getvalue does not copy the bytes a BytesIO was created from
+        table, pos = ItemTable.decode(
+            stream.getvalue(), stream_tell(stream, path), count, context._root._params.gbx_data, parse_node
+        )
+        stream_seek(stream, pos, 0, path)
+        return table
+
+    def _build(self, obj, stream, context, path):
+        from src.item_table import ItemTable
+
+        if not isinstance(obj, ItemTable):
+            return self.subcon._build(obj, stream, context, path)
+
+        def build_node(node):
+            node_stream = io.BytesIO()
+            self.node_struct._build(node, node_stream, context, path)
+            return node_stream.getvalue()
+
+        Int32ul._build(len(obj), stream, context, path)
+        raw = obj.encode(context._root._params.gbx_data, build_node)
+        stream_write(stream, raw, len(raw), path)
+        return obj
+
+
 body_chunks[0x03043040] = GbxLookbackStringContext(
     Struct(
         "version" / Int32ul,  # 7
         "u01" / Int32sl,
         "size" / Int32sl,
         "_listVersion" / Int32ul,
-        "anchoredObjects" / PrefixedArray(Int32ul, GbxClass),
+        "anchoredObjects" / GbxAnchoredObjects(GbxClass),
         "itemsOnItem"
         / If(
             lambda this: this.version >= 1 and this.version != 5,
@@ -962,19 +1750,7 @@ body_chunks[0x03043048] = Struct(
     #     ),
     # ),
 )
-body_chunks[0x03043049] = Struct(
-    "bytes_until_0x0304304B"
-    / IfThenElse(
-        lambda this: this._building,
-        GreedyBytes,
-        ExprAdapter(
-            RepeatUntil(lambda x, lst, ctx: lst[-4:] == [0x4B, 0x30, 0x04, 0x03], Byte),
-            lambda obj, ctx: bytes(obj[:-4]),
-            lambda obj, ctx: GreedyBytes.build(obj + b"\x4B\x30\x04\x03"),
-        ),
-    ),
-    Seek(-4, 1),
-)
+body_chunks[0x03043049] = Struct("bytes_until_0x0304304B" / BytesUntil(b"\x4B\x30\x04\x03"))
 # = Struct(
 #     "version" / Int32ul,
 #     "clipIntro" / GbxNodeRef,  # CGameCtnMediaClip
@@ -1000,7 +1776,7 @@ SHmsLightMapCacheSmall = Struct(
     "data"
     / If(
         lambda this: len(this.lightmapFrames) > 0,
-        CompressedZLib(
+        GbxDeferredZLib(
             Struct(
                 "body" / GbxLookbackStringContext(GbxBodyChunks),
                 "rest" / GreedyBytes,
@@ -2127,23 +2903,23 @@ body_chunks[0x09056000] = Struct(
             and this.compressFloat3InLocal3D
             else this.DataDecl[this._index].header.Type,
             {
-                "Float1": Float32l[this.num_vertices],
-                "Float2": GbxVec2[this.num_vertices],
-                "Float3": GbxVec3[this.num_vertices],
-                "Float4": GbxVec4[this.num_vertices],
-                "ColorD3D": GbxColor[this.num_vertices],
-                "UByte4": Int8ul[4][this.num_vertices],
-                "Short2": Int16sl[2][this.num_vertices],
-                "Short4": Int16sl[4][this.num_vertices],
-                "UByte4N": Bytes(4)[this.num_vertices],
-                "Short2N": Bytes(4)[this.num_vertices],
-                "Short4N": Bytes(8)[this.num_vertices],
-                "UShort2N": Bytes(4)[this.num_vertices],
-                "UShort4N": Bytes(8)[this.num_vertices],
-                "UDec3": Bytes(4)[this.num_vertices],
-                "Dec3N": GbxDec3N[this.num_vertices],
-                "Half2": Int16sl[2][this.num_vertices],
-                "Half4": Int16sl[4][this.num_vertices],
+                "Float1": NumpyArray(this.num_vertices, "<f4"),
+                "Float2": NumpyArray(this.num_vertices, GbxVec2Dtype),
+                "Float3": NumpyArray(this.num_vertices, GbxVec3Dtype),
+                "Float4": NumpyArray(this.num_vertices, GbxVec4Dtype),
+                "ColorD3D": NumpyArray(this.num_vertices, GbxColorDtype),
+                "UByte4": NumpyArray(this.num_vertices, ("u1", 4)),
+                "Short2": NumpyArray(this.num_vertices, ("<i2", 2)),
+                "Short4": NumpyArray(this.num_vertices, ("<i2", 4)),
+                "UByte4N": NumpyArray(this.num_vertices, ("u1", 4)),
+                "Short2N": NumpyArray(this.num_vertices, ("u1", 4)),
+                "Short4N": NumpyArray(this.num_vertices, ("u1", 8)),
+                "UShort2N": NumpyArray(this.num_vertices, ("u1", 4)),
+                "UShort4N": NumpyArray(this.num_vertices, ("u1", 8)),
+                "UDec3": NumpyArray(this.num_vertices, ("u1", 4)),
+                "Dec3N": GbxDec3NArray(this.num_vertices),
+                "Half2": NumpyArray(this.num_vertices, ("<i2", 2)),
+                "Half4": NumpyArray(this.num_vertices, ("<i2", 4)),
             },
         ),
     ),
@@ -2153,11 +2929,11 @@ body_chunks[0x09056000] = Struct(
 
 body_chunks[0x09057000] = Struct(
     "version" / Int32ul,
-    "indices" / PrefixedArray(Int32ul, Int16ul),
+    "indices" / PrefixedNumpyArray(Int32ul, "<u2"),
 )
 body_chunks[0x09057001] = Struct(
     "flags" / Int32ul,  # TODO check if not 2 what that means
-    "indices" / PrefixedArray(Int32ul, Int16sl),
+    "indices" / PrefixedNumpyArray(Int32ul, "<i2"),
 )
 
 # 0906A CPlugVisualIndexed
@@ -3721,8 +4497,9 @@ def reset_lookbackstring(obj, ctx):
     return obj
 
 
-def create_gbx_struct(gbx_body):
-    return Struct(
+def create_gbx_struct(gbx_body=None):
+    """Without gbx_body, parsing stops right after the reference table."""
+    header = [
         Const(b"GBX"),
         "version" / ExprValidator(Int16ul, obj_ == 6),
         Const(b"BU"),
@@ -3830,6 +4607,13 @@ def create_gbx_struct(gbx_body):
                 ),
             ),
         ),
+    ]
+
+    if gbx_body is None:
+        return Struct(*header)
+
+    return Struct(
+        *header,
         "body"
         / GbxLookbackStringContext(
             IfThenElse(
@@ -3844,3 +4628,34 @@ def create_gbx_struct(gbx_body):
 
 GbxStruct = create_gbx_struct(GbxBody)
 GbxStructWithoutBodyParsed = create_gbx_struct(GreedyBytes)
+GbxStructHeaderOnly = create_gbx_struct()
+
+
+compiled_body_chunks = {}
+interpreted_body_chunks = {}
+compile_failures = {}
+
+
+def use_compiled_body_chunks(enabled=True, chunk_ids=None):
+    """Replaces the body chunk structs with their compiled version (or back to the interpreted one).
+    Chunks which cannot be compiled stay interpreted, the reason is kept in compile_failures."""
+    if chunk_ids is None:
+        chunk_ids = list(interpreted_body_chunks) if not enabled else list(body_chunks)
+
+    for chunkId in chunk_ids:
+        if chunkId not in interpreted_body_chunks:
+            interpreted_body_chunks[chunkId] = body_chunks[chunkId]
+
+        if not enabled:
+            body_chunks[chunkId] = interpreted_body_chunks[chunkId]
+            continue
+
+        if chunkId not in compiled_body_chunks and chunkId not in compile_failures:
+            try:
+                compiled_body_chunks[chunkId] = compile_construct(
+                    interpreted_body_chunks[chunkId], boundaries=(GbxBody, GbxBodyChunks)
+                )
+            except Exception as e:
+                compile_failures[chunkId] = e
+
+        body_chunks[chunkId] = compiled_body_chunks.get(chunkId, interpreted_body_chunks[chunkId])
@@ -0,0 +1,375 @@
+import struct
+
+import numpy as np
+from construct import Container, ListContainer
+
+from src.gbx_structs import GbxCollectionIds, GbxCollectionIdsFromStr
+
+ITEM_DTYPE = np.dtype(
+    [
+        ("version", np.uint32),
+        ("itemModel", np.int32),  # index in models
+        ("rotPitchYawRoll", np.float32, 3),
+        ("blockUnitCoord", np.uint8, 3),
+        ("anchorTreeId", np.int32),  # index in anchor_tree_ids
+        ("absolutePositionInMap", np.float32, 3),
+        ("flags", np.uint16),
+        ("pivotPosition", np.float32, 3),
+        ("scale", np.float32),
+        ("u01", np.float32, 3),
+        ("u02", np.float32, 3),
+    ]
+)
+
+ITEM_CLASS_ID = 0x03101000
+ITEM_CHUNK_ID = 0x03101002
+FACADE = 0xFACADE01
+NO_CLASS = 0xFFFFFFFF
+
+U32 = struct.Struct("<I")
+ITEM_HEADER = struct.Struct("<III")  # classId, chunkId, version
+ROT_COORD = struct.Struct("<3f3B")
+POSITION_WAYPOINT = struct.Struct("<3fI")
+ITEM_TAIL = struct.Struct("<H3ff3f3fI")  # flags, pivot, scale, u01, u02, FACADE01
+
+
+class UnsupportedItem(Exception):
+    pass
+
+
+def read_lookbackstring(data, pos, gbx_data):
+    """Same as GbxLookbackString, returns the string and the position after it"""
+    if not gbx_data["lookbackstring_version"]:
+        if U32.unpack_from(data, pos)[0] != 3:
+            raise UnsupportedItem("lookback string version")
+        gbx_data["lookbackstring_version"] = True
+        pos += 4
+
+    index = U32.unpack_from(data, pos)[0]
+    pos += 4
+    flags = index >> 30
+    idx = index & 0x3FFFFFFF
+
+    if idx == 0x3FFFFFFF:
+        if flags == 2:
+            return "Unassigned", pos
+        if flags == 3:
+            return "", pos
+        raise UnsupportedItem("lookback string flags")
+    if flags == 0:
+        if idx not in GbxCollectionIds:
+            raise UnsupportedItem("unknown collection id")
+        return GbxCollectionIds[idx], pos
+    if idx == 0:
+        size = U32.unpack_from(data, pos)[0]
+        s = bytes(data[pos + 4 : pos + 4 + size]).decode("utf-8")
+        gbx_data["lookbackstring_index"] += 1
+        gbx_data["lookbackstring_table"][gbx_data["lookbackstring_index"]] = s
+        return s, pos + 4 + size
+    if idx in gbx_data["lookbackstring_table"]:
+        return gbx_data["lookbackstring_table"][idx], pos
+    raise UnsupportedItem("invalid lookback string index")
+
+
+def write_lookbackstring(parts, s, gbx_data):
+    """Same as GbxLookbackString when building"""
+    if not gbx_data["lookbackstring_version"]:
+        gbx_data["lookbackstring_version"] = True
+        parts.append(U32.pack(3))
+
+    if s == "Unassigned":
+        parts.append(U32.pack(0xBFFFFFFF))
+    elif s == "":
+        parts.append(U32.pack(0xFFFFFFFF))
+    elif s in GbxCollectionIdsFromStr:
+        parts.append(U32.pack(GbxCollectionIdsFromStr[s]))
+    elif s in gbx_data["lookbackstring_table"]:
+        parts.append(U32.pack(0x40000000 | gbx_data["lookbackstring_table"][s]))
+    else:
+        gbx_data["lookbackstring_index"] += 1
+        gbx_data["lookbackstring_table"][s] = gbx_data["lookbackstring_index"]
+        raw = s.encode("utf-8")
+        parts.append(U32.pack(0x40000000))
+        parts.append(U32.pack(len(raw)))
+        parts.append(raw)
+
+
+def vec3(values):
+    return Container(x=values[0], y=values[1], z=values[2])
+
+
+def xyz(vec):
+    return (vec["x"], vec["y"], vec["z"])
+
+
+ZERO = Container(x=0.0, y=0.0, z=0.0)
+
+
+def item_chunk(node):
+    """0x03101002 of an anchored object if it is the only chunk of its body, else None"""
+    body = node.get("body", None)
+    if node.get("classId", None) != ITEM_CLASS_ID or not isinstance(body, list) or len(body) != 2:
+        return None
+    if body[0].get("chunkId", None) != ITEM_CHUNK_ID or "skippable" in body[0] or body[1].chunkId != FACADE:
+        return None
+    return body[0].chunk
+
+
+def is_simple_item(chunk):
+    """Items read and written by the fast path, the others are kept as nodes and go through construct"""
+    return (
+        chunk is not None
+        and chunk.version == 8
+        and chunk.waypointSpecialProperty.classId == NO_CLASS
+        and chunk.packDesc is None
+    )
+
+
+class ItemTable:
+    """Anchored objects (items) of map chunk 0x03043040 as a NumPy structured array, one row per item.
+
+    Item models are interned in `models` as (id, collection, author) and anchor tree ids in `anchor_tree_ids`,
+    the rows keep their index. Items with a waypoint, a pack desc, another version or more chunks keep their
+    node in `nodes` by row: the columns are written back in them when building.
+
+    Parsing with columnar=True gives an ItemTable instead of the list of nodes, read and written straight from
+    the bytes. Otherwise convert with from_anchored_objects and to_anchored_objects.
+
+        table = chunk.anchoredObjects
+        table.translate((0, 8, 0), rows=table.where(model="Turbo.Item.Gbx"))
+    """
+
+    def __init__(self, items, models, anchor_tree_ids, nodes=None):
+        self.items = items
+        self.models = list(models)
+        self.anchor_tree_ids = list(anchor_tree_ids)
+        self.nodes = nodes or {}
+
+    @classmethod
+    def from_anchored_objects(cls, anchored_objects):
+        models = {}
+        anchor_tree_ids = {}
+        rows = []
+        nodes = {}
+        for i, node in enumerate(anchored_objects):
+            chunk = item_chunk(node)
+            if not is_simple_item(chunk):
+                nodes[i] = node
+                if chunk is None:
+                    chunk = next(c.chunk for c in node.body if c.get("chunkId", None) == ITEM_CHUNK_ID)
+            rows.append(cls.row_from_chunk(chunk, models, anchor_tree_ids))
+
+        return cls(np.array(rows, dtype=ITEM_DTYPE), models, anchor_tree_ids, nodes)
+
+    @staticmethod
+    def row_from_chunk(chunk, models, anchor_tree_ids):
+        model = chunk["itemModel"]
+        get = chunk.get
+        return (
+            chunk["version"],
+            models.setdefault((model["id"], model["collection"], model["author"]), len(models)),
+            xyz(chunk["rotPitchYawRoll"]),
+            xyz(chunk["blockUnitCoord"]),
+            anchor_tree_ids.setdefault(chunk["anchorTreeId"], len(anchor_tree_ids)),
+            xyz(chunk["absolutePositionInMap"]),
+            get("flags", 0),
+            xyz(get("pivotPosition", ZERO)),
+            get("scale", 1.0),
+            xyz(get("u01", ZERO)),
+            xyz(get("u02", ZERO)),
+        )
+
+    def update_chunk(self, chunk, i):
+        """Writes the columns of row i in an item chunk, only the fields of its version"""
+        row = self.items[i]
+        model_id, collection, author = self.models[row["itemModel"]]
+        chunk.itemModel = Container(id=model_id, collection=collection, author=author)
+        chunk.rotPitchYawRoll = vec3(row["rotPitchYawRoll"].tolist())
+        chunk.blockUnitCoord = vec3(row["blockUnitCoord"].tolist())
+        chunk.anchorTreeId = self.anchor_tree_ids[row["anchorTreeId"]]
+        chunk.absolutePositionInMap = vec3(row["absolutePositionInMap"].tolist())
+        if "flags" in chunk:
+            chunk.flags = int(row["flags"])
+        for name in ("pivotPosition", "u01", "u02"):
+            if name in chunk:
+                chunk[name] = vec3(row[name].tolist())
+        if "scale" in chunk:
+            chunk.scale = float(row["scale"])
+
+    def to_anchored_objects(self):
+        """Nodes as parsed, to be set back in the chunk"""
+        columns = {name: self.items[name].tolist() for name in ITEM_DTYPE.names}
+        anchored_objects = ListContainer()
+        for i in range(len(self)):
+            if i in self.nodes:
+                node = self.nodes[i]
+                self.update_chunk(next(c.chunk for c in node.body if c.get("chunkId", None) == ITEM_CHUNK_ID), i)
+                anchored_objects.append(node)
+                continue
+
+            model_id, collection, author = self.models[columns["itemModel"][i]]
+            chunk = Container(
+                version=columns["version"][i],
+                itemModel=Container(id=model_id, collection=collection, author=author),
+                rotPitchYawRoll=vec3(columns["rotPitchYawRoll"][i]),
+                blockUnitCoord=vec3(columns["blockUnitCoord"][i]),
+                anchorTreeId=self.anchor_tree_ids[columns["anchorTreeId"][i]],
+                absolutePositionInMap=vec3(columns["absolutePositionInMap"][i]),
+                waypointSpecialProperty=Container(classId=NO_CLASS, body=None),
+                u03=None,
+                flags=columns["flags"][i],
+                pivotPosition=vec3(columns["pivotPosition"][i]),
+                scale=columns["scale"][i],
+                packDesc=None,
+                u01=vec3(columns["u01"][i]),
+                u02=vec3(columns["u02"][i]),
+            )
+            anchored_objects.append(
+                Container(
+                    classId=ITEM_CLASS_ID,
+                    body=ListContainer([Container(chunkId=ITEM_CHUNK_ID, chunk=chunk), Container(chunkId=FACADE)]),
+                )
+            )
+        return anchored_objects
+
+    @classmethod
+    def decode(cls, data, pos, count, gbx_data, parse_node):
+        """Reads count anchored objects from data at pos, returns the table and the position after them.
+        parse_node(pos) parses the items the fast path does not handle, it returns the node and its end."""
+        models = {}
+        anchor_tree_ids = {}
+        rows = []
+        nodes = {}
+        for i in range(count):
+            start = pos
+            lookback_index = gbx_data["lookbackstring_index"]
+            lookback_version = gbx_data["lookbackstring_version"]
+            try:
+                class_id, chunk_id, version = ITEM_HEADER.unpack_from(data, pos)
+                if class_id != ITEM_CLASS_ID or chunk_id != ITEM_CHUNK_ID or version != 8:
+                    raise UnsupportedItem("not a version 8 item")
+                model_id, pos = read_lookbackstring(data, pos + 12, gbx_data)
+                collection, pos = read_lookbackstring(data, pos, gbx_data)
+                author, pos = read_lookbackstring(data, pos, gbx_data)
+                rx, ry, rz, bx, by, bz = ROT_COORD.unpack_from(data, pos)
+                anchor_tree_id, pos = read_lookbackstring(data, pos + ROT_COORD.size, gbx_data)
+                px, py, pz, waypoint = POSITION_WAYPOINT.unpack_from(data, pos)
+                if waypoint != NO_CLASS:
+                    raise UnsupportedItem("waypoint")
+                pos += POSITION_WAYPOINT.size
+                flags, pvx, pvy, pvz, scale, ax, ay, az, cx, cy, cz, facade = ITEM_TAIL.unpack_from(data, pos)
+                if flags & 4 or facade != FACADE:
+                    raise UnsupportedItem("pack desc or more chunks")
+                pos += ITEM_TAIL.size
+            except (UnsupportedItem, struct.error, UnicodeDecodeError):
+                # forget the strings read by the fast path, construct reads them again
+                table = gbx_data["lookbackstring_table"]
+                for idx in range(lookback_index + 1, gbx_data["lookbackstring_index"] + 1):
+                    table.pop(idx, None)
+                gbx_data["lookbackstring_index"] = lookback_index
+                gbx_data["lookbackstring_version"] = lookback_version
+
+                node, pos = parse_node(start)
+                nodes[i] = node
+                chunk = next(c.chunk for c in node.body if c.get("chunkId", None) == ITEM_CHUNK_ID)
+                rows.append(cls.row_from_chunk(chunk, models, anchor_tree_ids))
+                continue
+
+            rows.append(
+                (
+                    8,
+                    models.setdefault((model_id, collection, author), len(models)),
+                    (rx, ry, rz),
+                    (bx, by, bz),
+                    anchor_tree_ids.setdefault(anchor_tree_id, len(anchor_tree_ids)),
+                    (px, py, pz),
+                    flags,
+                    (pvx, pvy, pvz),
+                    scale,
+                    (ax, ay, az),
+                    (cx, cy, cz),
+                )
+            )
+
+        return cls(np.array(rows, dtype=ITEM_DTYPE), models, anchor_tree_ids, nodes), pos
+
+    def encode(self, gbx_data, build_node):
+        """Bytes of the anchored objects, without their count. build_node(node) builds the items kept as nodes."""
+        columns = {name: self.items[name].tolist() for name in ITEM_DTYPE.names}
+        parts = []
+        for i in range(len(self)):
+            if i in self.nodes:
+                node = self.nodes[i]
+                self.update_chunk(next(c.chunk for c in node.body if c.get("chunkId", None) == ITEM_CHUNK_ID), i)
+                parts.append(build_node(node))
+                continue
+
+            model_id, collection, author = self.models[columns["itemModel"][i]]
+            parts.append(ITEM_HEADER.pack(ITEM_CLASS_ID, ITEM_CHUNK_ID, columns["version"][i]))
+            write_lookbackstring(parts, model_id, gbx_data)
+            write_lookbackstring(parts, collection, gbx_data)
+            write_lookbackstring(parts, author, gbx_data)
+            parts.append(ROT_COORD.pack(*columns["rotPitchYawRoll"][i], *columns["blockUnitCoord"][i]))
+            write_lookbackstring(parts, self.anchor_tree_ids[columns["anchorTreeId"][i]], gbx_data)
+            parts.append(POSITION_WAYPOINT.pack(*columns["absolutePositionInMap"][i], NO_CLASS))
+            parts.append(
+                ITEM_TAIL.pack(
+                    columns["flags"][i] & ~4,
+                    *columns["pivotPosition"][i],
+                    columns["scale"][i],
+                    *columns["u01"][i],
+                    *columns["u02"][i],
+                    FACADE,
+                )
+            )
+        return b"".join(parts)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, rows):
+        """Sub table of the given rows (index array, slice or boolean mask), string tables are kept as they are"""
+        rows = np.arange(len(self))[rows]
+        old_rows = {old: new for new, old in enumerate(rows.tolist())}
+        return ItemTable(
+            self.items[rows],
+            self.models,
+            self.anchor_tree_ids,
+            {old_rows[row]: node for row, node in self.nodes.items() if row in old_rows},
+        )
+
+    @property
+    def model_ids(self):
+        return np.array([model[0] for model in self.models], dtype=object)[self.items["itemModel"]]
+
+    def where(self, model=None, min_position=None, max_position=None):
+        """Boolean mask of the items matching all the given conditions.
+        model is a prefix of the item model id, position bounds are inclusive."""
+        mask = np.ones(len(self), dtype=bool)
+        if model is not None:
+            matching = [i for i, (model_id, _, _) in enumerate(self.models) if model_id.startswith(model)]
+            mask &= np.isin(self.items["itemModel"], matching)
+        positions = self.items["absolutePositionInMap"]
+        if min_position is not None:
+            mask &= np.all(positions >= np.asarray(min_position), axis=1)
+        if max_position is not None:
+            mask &= np.all(positions <= np.asarray(max_position), axis=1)
+        return mask
+
+    def translate(self, offset, rows=None):
+        """Moves the items, all of them or only the given rows, and updates their block coords"""
+        rows = slice(None) if rows is None else rows
+        positions = self.items["absolutePositionInMap"]
+        positions[rows] += np.asarray(offset, dtype=np.float32)
+        # same block unit as new_anchored_object: 32 x 8 x 32
+        block_coords = np.floor_divide(positions[rows], np.array([32, 8, 32], dtype=np.float32))
+        self.items["blockUnitCoord"][rows] = np.clip(block_coords, 0, 255).astype(np.uint8)
+
+    def counts(self):
+        """Number of items of each model id"""
+        counts = np.bincount(self.items["itemModel"], minlength=len(self.models))
+        res = {}
+        for (model_id, _, _), count in zip(self.models, counts):
+            if count:
+                res[model_id] = res.get(model_id, 0) + int(count)
+        return res
@@ -314,211 +314,128 @@ def lzo1x_1_compress(bytes_in, bytes_out, wrkmem):
     return bytes(bytes_out[:op])
 
 
-def match_next(bytes_out, bytes_in, op, ip, tmp):
-    op, ip, tmp = copy_nbytes(bytes_out, bytes_in, op, ip, tmp, 1)
+def copy_match(bytes_out, op, m_pos, length):
+    """Copies length bytes from m_pos to op. When they overlap the copied run repeats itself,
+    so the source slice doubles at each step instead of copying byte per byte."""
+    if op - m_pos >= length:
+        bytes_out[op : op + length] = bytes_out[m_pos : m_pos + length]
+        return op + length
 
-    tmp = bytes_in[ip]
-    ip += 1
-
-    return op, ip, tmp
-
-
-def copy_match(bytes_out, op, m_pos, tmp):
-    bytes_out[op] = bytes_out[m_pos]
-    op += 1
-    m_pos += 1
-    bytes_out[op] = bytes_out[m_pos]
-    op += 1
-    m_pos += 1
-
-    return copy_nbytes(bytes_out, bytes_out, op, m_pos, tmp, 1)
+    end = op + length
+    while op < end:
+        n = min(op - m_pos, end - op)
+        bytes_out[op : op + n] = bytes_out[m_pos : m_pos + n]
+        op += n
+    return op
 
 
 def lzo1x_decompress(bytes_in, bytes_out):
+    """Same states as lzo1x_decompress in minilzo.c, literal runs and matches are copied with slices."""
     ip_end = len(bytes_in)
     op = 0  # out pointer
     ip = 0  # in pointer
-    tmp = 0
-    m_pos = 0  # match pos
-    gt_first_literal_run = False
-    gt_match_done = False
-    gt_match = False
-    gt_eof_found = False
-    gt_match_next = False
-
-    if bytes_in[ip] > 17:
-        tmp = bytes_in[ip] - 17
+    state = 0  # literals to copy after a match
+
+    tmp = bytes_in[ip]
+    if tmp > 17:
         ip += 1
+        tmp -= 17
         if tmp < 4:
-            gt_match_next = True
-        else:
-            op, ip, tmp = copy_nbytes(bytes_out, bytes_in, op, ip, tmp, 1)
-
-            gt_first_literal_run = True
-
-    while True:
-        if gt_first_literal_run or gt_match_next:
-            pass
-        else:
+            # match_next
+            state = tmp
+            bytes_out[op : op + tmp] = bytes_in[ip : ip + tmp]
+            op += tmp
+            ip += tmp
             tmp = bytes_in[ip]
             ip += 1
-
-            if tmp >= 16:
-                gt_match = True
-            else:
-                if tmp == 0:
-                    while bytes_in[ip] == 0:
-                        tmp += 255
-                        ip += 1
-
-                    tmp += 15 + bytes_in[ip]
-                    ip += 1
-
-                bytes_out[op : op + 4] = bytes_in[ip : ip + 4]
-                op += 4
-                ip += 4
-
-                tmp -= 1
-                if tmp >= 4:
-                    op, ip, tmp = copy_nbytes(bytes_out, bytes_in, op, ip, tmp, 4)
-                if tmp > 0:
-                    op, ip, tmp = copy_nbytes(bytes_out, bytes_in, op, ip, tmp, 1)
-
-        # first_literal_run:
-        gt_first_literal_run = False
-        if gt_match or gt_match_next:
-            pass
         else:
+            bytes_out[op : op + tmp] = bytes_in[ip : ip + tmp]
+            op += tmp
+            ip += tmp
+            # first_literal_run
             tmp = bytes_in[ip]
             ip += 1
-
-            if tmp >= 16:
-                gt_match = True
-            else:
-                m_pos = op - (1 + 0x0800)
-                m_pos -= tmp >> 2
-                m_pos -= bytes_in[ip] << 2
+            if tmp < 16:
+                m_pos = op - (1 + 0x0800) - (tmp >> 2) - (bytes_in[ip] << 2)
                 ip += 1
+                op = copy_match(bytes_out, op, m_pos, 3)
+                tmp = -1
+    else:
+        tmp = -1
 
-                bytes_out[op] = bytes_out[m_pos]
-                op += 1
-                m_pos += 1
-                bytes_out[op] = bytes_out[m_pos]
-                op += 1
-                m_pos += 1
-                bytes_out[op] = bytes_out[m_pos]
-                op += 1
-                gt_match_done = True
-
-        # match:
-        gt_match = False
-        while True:
-            if gt_match_done or gt_match_next:
-                pass
-            elif tmp >= 64:
-                m_pos = op - 1
-                m_pos -= (tmp >> 2) & 7
-                m_pos -= bytes_in[ip] << 3
+    while True:
+        if tmp < 0:
+            # match_done
+            state = bytes_in[ip - 2] & 3 if ip >= 2 else 0
+            if state:
+                # match_next
+                bytes_out[op : op + state] = bytes_in[ip : ip + state]
+                op += state
+                ip += state
+                tmp = bytes_in[ip]
+                ip += 1
+            else:
+                tmp = bytes_in[ip]
                 ip += 1
-                tmp = (tmp >> 5) - 1
-
-                op, m_pos, tmp = copy_match(bytes_out, op, m_pos, tmp)
-                gt_match_done = True
-            elif tmp >= 32:
-                tmp &= 31
-                if tmp == 0:
-                    while bytes_in[ip] == 0:
-                        tmp += 255
+                if tmp < 16:
+                    # literal run
+                    if tmp == 0:
+                        while bytes_in[ip] == 0:
+                            tmp += 255
+                            ip += 1
+                        tmp += 15 + bytes_in[ip]
                         ip += 1
+                    tmp += 3
+                    bytes_out[op : op + tmp] = bytes_in[ip : ip + tmp]
+                    op += tmp
+                    ip += tmp
 
-                    tmp += 31 + bytes_in[ip]
+                    # first_literal_run
+                    tmp = bytes_in[ip]
                     ip += 1
-
-                m_pos = op - 1
-                assert (bytes_in[ip] + (bytes_in[ip + 1] << 0x8)) == struct.unpack_from(
-                    "<H", bytes_in, ip
-                )[0]
-                m_pos -= struct.unpack_from("<H", bytes_in, ip)[0] >> 2
-                ip += 2
-            elif tmp >= 16:
-                m_pos = op
-                m_pos -= (tmp & 8) << 11
-                tmp &= 7
-                if tmp == 0:
-                    while bytes_in[ip] == 0:
-                        tmp += 255
+                    if tmp < 16:
+                        m_pos = op - (1 + 0x0800) - (tmp >> 2) - (bytes_in[ip] << 2)
                         ip += 1
+                        op = copy_match(bytes_out, op, m_pos, 3)
+                        tmp = -1
+                        continue
 
-                    tmp += 7 + bytes_in[ip]
-                    ip += 1
-
-                assert (bytes_in[ip] + (bytes_in[ip + 1] << 0x8)) == struct.unpack_from(
-                    "<H", bytes_in, ip
-                )[0]
-                m_pos -= struct.unpack_from("<H", bytes_in, ip)[0] >> 2
-                ip += 2
-                if m_pos == op:
-                    gt_eof_found = True
-                    break
-                m_pos -= 0x4000
-            else:
-                m_pos = op - 1
-                m_pos -= tmp >> 2
-                m_pos -= bytes_in[ip] << 2
-                ip += 1
-                bytes_out[op] = bytes_out[m_pos]
-                op += 1
-                m_pos += 1
-                bytes_out[op] = bytes_out[m_pos]
-                op += 1
-                gt_match_done = True
-
-            if gt_match_done or gt_match_next:
-                pass
-            elif (tmp >= (2 * 4 - (3 - 1))) and ((op - m_pos) >= 4):
-                bytes_out[op : op + 4] = bytes_out[m_pos : m_pos + 4]
-                op += 4
-                m_pos += 4
-                tmp -= 4 - (3 - 1)
-
-                op, m_pos, tmp = copy_nbytes(bytes_out, bytes_out, op, m_pos, tmp, 4)
-                if tmp > 0:
-                    op, m_pos, tmp = copy_nbytes(
-                        bytes_out, bytes_out, op, m_pos, tmp, 1
-                    )
-            else:
-                # copy_match:
-                op, m_pos, tmp = copy_match(bytes_out, op, m_pos, tmp)
-
-            # match_done:
-            if gt_match_next:
-                pass
-            else:
-                gt_match_done = False
-                tmp = bytes_in[ip - 2] & 3
-                if tmp == 0:
-                    break
-
-            # match_next:
-            gt_match_next = False
-            bytes_out[op] = bytes_in[ip]
-            op += 1
+        # match
+        if tmp >= 64:
+            m_pos = op - 1 - ((tmp >> 2) & 7) - (bytes_in[ip] << 3)
             ip += 1
-
-            if tmp > 1:
-                bytes_out[op] = bytes_in[ip]
-                op += 1
+            op = copy_match(bytes_out, op, m_pos, (tmp >> 5) + 1)
+        elif tmp >= 32:
+            tmp &= 31
+            if tmp == 0:
+                while bytes_in[ip] == 0:
+                    tmp += 255
+                    ip += 1
+                tmp += 31 + bytes_in[ip]
                 ip += 1
-                if tmp > 2:
-                    bytes_out[op] = bytes_in[ip]
-                    op += 1
+            m_pos = op - 1 - ((bytes_in[ip] | (bytes_in[ip + 1] << 8)) >> 2)
+            ip += 2
+            op = copy_match(bytes_out, op, m_pos, tmp + 2)
+        elif tmp >= 16:
+            m_pos = op - ((tmp & 8) << 11)
+            tmp &= 7
+            if tmp == 0:
+                while bytes_in[ip] == 0:
+                    tmp += 255
                     ip += 1
-
-            tmp = bytes_in[ip]
+                tmp += 7 + bytes_in[ip]
+                ip += 1
+            m_pos -= (bytes_in[ip] | (bytes_in[ip + 1] << 8)) >> 2
+            ip += 2
+            if m_pos == op:
+                # eof_found
+                break
+            op = copy_match(bytes_out, op, m_pos - 0x4000, tmp + 2)
+        else:
+            m_pos = op - 1 - (tmp >> 2) - (bytes_in[ip] << 2)
             ip += 1
-
-        if gt_eof_found:
-            break
+            op = copy_match(bytes_out, op, m_pos, 2)
+        tmp = -1
 
     # eof_found:
     # out_len = op
@@ -533,6 +450,9 @@ def lzo1x_decompress(bytes_in, bytes_out):
 
 def decompress(bytes_in, out_len):
     assert isinstance(out_len, int)
+    if not isinstance(bytes_in, bytes):
+        # indexing bytes is faster than indexing a memoryview
+        bytes_in = bytes(bytes_in)
     bytes_out = bytearray(out_len)
     lzo1x_decompress(bytes_in, bytes_out)
     return bytes(bytes_out)
@@ -1,6 +1,33 @@
+import io
 import itertools
+from functools import partial
 
-from construct import Subconstruct, ListContainer, evaluate
+import numpy as np
+
+from construct import (
+    Construct,
+    Subconstruct,
+    Adapter,
+    Array,
+    Computed,
+    LazyBound,
+    RepeatUntil,
+    FocusedSeq,
+    Rebuild,
+    len_,
+    this,
+    ListContainer,
+    evaluate,
+    stream_tell,
+    stream_seek,
+    stream_read,
+    stream_write,
+    RangeError,
+    RepeatError,
+    SizeofError,
+    StreamError,
+)
+from construct.expr import ExprMixin
 
 
 class MyRepeatUntil(Subconstruct):
@@ -82,31 +109,37 @@ class MyRepeatUntil(Subconstruct):
         )
 
     def _emitparse(self, code):
-        fname = f"parse_repeatuntil_{code.allocateId()}"
+        fname = f"parse_myrepeatuntil_{code.allocateId()}"
         block = f"""
             def {fname}(io, this):
                 list_ = ListContainer()
-                while True:
+                this['_array'] = list_
+                for i in itertools.count():
+                    this['_index'] = i
                     obj_ = {self.subcon._compileparse(code)}
                     if not ({self.discard}):
                         list_.append(obj_)
-                    if ({self.predicate}):
+                    if ({repr(self.predicate)}):
                         return list_
         """
         code.append(block)
         return f"{fname}(io, this)"
 
     def _emitbuild(self, code):
-        fname = f"build_repeatuntil_{code.allocateId()}"
+        fname = f"build_myrepeatuntil_{code.allocateId()}"
         block = f"""
             def {fname}(obj, io, this):
-                objiter = iter(obj)
                 list_ = ListContainer()
-                while True:
-                    obj_ = reuse(next(objiter), lambda obj: {self.subcon._compilebuild(code)})
-                    list_.append(obj_)
-                    if ({self.predicate}):
+                this['_array'] = list_
+                for i, e in enumerate(obj):
+                    this['_index'] = i
+                    obj_ = reuse(e, lambda obj: {self.subcon._compilebuild(code)})
+                    if not ({self.discard}):
+                        list_.append(obj_)
+                    obj_ = e
+                    if ({repr(self.predicate)}):
                         return list_
+                raise RepeatError("expected any item to match predicate, when building")
         """
         code.append(block)
         return f"{fname}(obj, io, this)"
@@ -117,3 +150,331 @@ class MyRepeatUntil(Subconstruct):
             repeat="until",
             repeat_until=repr(self.predicate).replace("obj_", "_"),
         )
+
+
+def stream_read_view(stream, length, path):
+    """Same as stream_read, but returns a memoryview of the bytes held by a BytesIO instead of a copy."""
+    if not isinstance(stream, io.BytesIO):
+        return stream_read(stream, length, path)
+
+    if length < 0:
+        raise StreamError(f"length must be non-negative, found {length}", path=path)
+    offset = stream_tell(stream, path)
+    # getvalue does not copy the bytes a BytesIO was created from
+    data = memoryview(stream.getvalue())[offset : offset + length]
+    if len(data) != length:
+        raise StreamError(f"stream read less than specified amount, expected {length}, found {len(data)}", path=path)
+    stream_seek(stream, offset + length, 0, path)
+    return data
+
+
+def to_numpy_array(obj, dtype):
+    """Converts what NumpyArray builds from (an array, or a list of elements as construct would take them)."""
+    dtype = np.dtype(dtype)
+    if dtype.names is not None and not isinstance(obj, np.ndarray):
+        return np.array([tuple(e[name] for name in dtype.names) for e in obj], dtype=dtype)
+    elif len(obj) > 0 and isinstance(obj[0], bytes):
+        return np.frombuffer(b"".join(obj), dtype=dtype)
+    else:
+        # subarray dtypes like ("u1", 4) are an extra dimension of the array
+        return np.asarray(obj, dtype=dtype.base).reshape((-1, *dtype.shape))
+
+
+class NumpyArray(Construct):
+    r"""
+    Homogenous array of fixed size elements, decoded in one go into a numpy array instead of one object per element.
+
+    Structured dtypes are returned as a record array, so fields are still accessible as attributes on each element (arr[i].x) or on the whole column (arr.x).
+
+    :param count: integer or context lambda, number of elements
+    :param dtype: numpy dtype of one element, with explicit byte order
+
+    :raises StreamError: could not read enough bytes
+    :raises RangeError: count is negative, or the built array does not have count elements
+
+    Example::
+
+        >>> d = NumpyArray(2, [("x", "<f4"), ("y", "<f4")])
+        >>> d.parse(d.build([Container(x=1, y=2), Container(x=3, y=4)])).y
+        array([2., 4.], dtype=float32)
+    """
+
+    def __init__(self, count, dtype):
+        super().__init__()
+        self.count = count
+        self.dtype = np.dtype(dtype)
+
+    def _parse(self, stream, context, path):
+        count = evaluate(self.count, context)
+        if count < 0:
+            raise RangeError(f"invalid count {count}", path=path)
+
+        # read straight into a writable buffer, the array is a view over it
+        data = bytearray(count * self.dtype.itemsize)
+        if stream.readinto(data) != len(data):
+            raise StreamError(f"stream read less than specified amount, expected {len(data)}", path=path)
+
+        obj = np.frombuffer(data, dtype=self.dtype)
+        if self.dtype.names is not None:
+            obj = obj.view(np.recarray)
+        return obj
+
+    def _build(self, obj, stream, context, path):
+        count = evaluate(self.count, context)
+        arr = to_numpy_array(obj, self.dtype)
+        if len(arr) != count:
+            raise RangeError(f"expected {count} elements, found {len(arr)}", path=path)
+
+        data = arr.tobytes()
+        stream_write(stream, data, len(data), path)
+        return obj
+
+    def _sizeof(self, context, path):
+        try:
+            count = evaluate(self.count, context)
+        except (KeyError, AttributeError):
+            raise SizeofError("cannot calculate size, key not found in context", path=path)
+        return count * self.dtype.itemsize
+
+
+def PrefixedNumpyArray(countfield, dtype):
+    r"""
+    Same as PrefixedArray, with the elements decoded as a NumpyArray.
+
+    :param countfield: Construct instance, field used for storing the element count
+    :param dtype: numpy dtype of one element, with explicit byte order
+
+    Example::
+
+        >>> d = PrefixedNumpyArray(Int32ul, "<u2")
+        >>> d.parse(b"\x02\x00\x00\x00\x01\x00\x02\x00")
+        array([1, 2], dtype=uint16)
+    """
+    return FocusedSeq(
+        "items",
+        "count" / Rebuild(countfield, len_(this.items)),
+        "items" / NumpyArray(this.count, dtype),
+    )
+
+
+class BytesUntil(Construct):
+    r"""
+    Bytes up to the next occurrence of a marker. The marker itself is not consumed, it is left in the stream for the next construct.
+
+    The stream is searched by blocks with bytes.find instead of byte by byte.
+
+    :param marker: bytes, searched marker
+
+    :raises StreamError: the marker was not found before the end of the stream
+
+    Example::
+
+        >>> d = Sequence(BytesUntil(b"\x01\xDE\xCA\xFA"), Int32ul)
+        >>> d.parse(b"abc\x01\xDE\xCA\xFA")
+        [b'abc', 4207599105]
+    """
+
+    def __init__(self, marker, block_size=0x10000):
+        super().__init__()
+        self.marker = marker
+        self.block_size = block_size
+
+    def _parse(self, stream, context, path):
+        start = stream_tell(stream, path)
+        data = bytearray()
+        block_size = self.block_size
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                raise StreamError(f"could not find marker {self.marker}", path=path)
+
+            # the marker may straddle two blocks
+            search_start = max(0, len(data) - len(self.marker) + 1)
+            data += block
+            idx = data.find(self.marker, search_start)
+            if idx != -1:
+                stream_seek(stream, start + idx, 0, path)
+                return bytes(data[:idx])
+
+            block_size *= 2
+
+    def _build(self, obj, stream, context, path):
+        stream_write(stream, obj, len(obj), path)
+        return obj
+
+    def _sizeof(self, context, path):
+        raise SizeofError("cannot calculate size, depends on actual data", path=path)
+
+
+class CompilableAdapter(Adapter):
+    """Adapter whose subcon can be compiled, _decode and _encode are called back from the compiled code"""
+
+    def _emitparse(self, code):
+        self._compileinstance(code)
+        return f"linkedinstances[{id(self)}]._decode({self.subcon._compileparse(code)}, this, '(???)')"
+
+    def _emitbuild(self, code):
+        # like Adapter._build, the built value is the original object, not the encoded one
+        self._compileinstance(code)
+        return (
+            f"reuse(obj, lambda original: (reuse(linkedinstances[{id(self)}]._encode(original, this, '(???)'), "
+            f"lambda obj: ({self.subcon._compilebuild(code)})), original)[1])"
+        )
+
+
+class LinkedExpr:
+    """Stands for a lambda (or a value without a valid repr) while compiling.
+    Its repr is the code calling it back from the compiled module."""
+
+    def __init__(self, func, args="this"):
+        self.func = func
+        self.args = args
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+    def __repr__(self):
+        if self.args is None:
+            return f"linkedexprs[{id(self)}]"
+        return f"linkedexprs[{id(self)}]({self.args})"
+
+    __str__ = __repr__
+
+
+def construct_children(sc):
+    for name in ("subcon", "thensubcon", "elsesubcon", "lengthfield", "default", "defersubcon"):
+        child = getattr(sc, name, None)
+        if isinstance(child, Construct):
+            yield child
+    for child in getattr(sc, "subcons", ()):
+        yield child
+    cases = getattr(sc, "cases", None)
+    if isinstance(cases, dict):
+        yield from cases.values()
+
+
+def _raise_not_implemented(code):
+    raise NotImplementedError
+
+
+def _emitparse_array(sc, code):
+    # construct's compiled Array does not set _index, which lambdas rely on
+    fname = f"parse_array_{code.allocateId()}"
+    code.append(f"""
+        def {fname}(io, this):
+            list_ = ListContainer()
+            for i in range({sc.count}):
+                this['_index'] = i
+                list_.append({sc.subcon._compileparse(code)})
+            return list_
+    """)
+    return f"{fname}(io, this)"
+
+
+def _emitbuild_array(sc, code):
+    fname = f"build_array_{code.allocateId()}"
+    code.append(f"""
+        def {fname}(obj, io, this):
+            list_ = ListContainer()
+            for i in range({sc.count}):
+                this['_index'] = i
+                list_.append(reuse(obj[i], lambda obj: ({sc.subcon._compilebuild(code)})))
+            return list_
+    """)
+    return f"{fname}(obj, io, this)"
+
+
+def _emitbuild_adapter(emitbuild, code):
+    # construct's compiled Enum, Mapping and StringEncoded return the encoded value,
+    # Adapter._build returns the original one
+    return f"reuse(obj, lambda original: ({emitbuild(code)}, original)[1])"
+
+
+def compile_construct(subcon, boundaries=()):
+    r"""
+    Same as subcon.compile(), but also works when the tree contains lambdas and adapters.
+
+    Lambdas are linked back into the compiled code instead of having their repr emitted, adapters compile their subcon. Constructs in boundaries (and LazyBound) are not compiled, the compiled code calls their interpreted version (use it to cut recursive structures).
+
+    The tree is left unchanged.
+    """
+    patched_attrs = []
+    patched_emits = {}
+    linkedexprs = {}
+
+    def link(sc, name, value, args):
+        expr = LinkedExpr(value, args)
+        linkedexprs[id(expr)] = expr
+        patched_attrs.append((sc, name, value))
+        setattr(sc, name, expr)
+
+    def patch_emits(sc, emitparse, emitbuild):
+        if id(sc) not in patched_emits:
+            patched_emits[id(sc)] = (sc, vars(sc).get("_emitparse"), vars(sc).get("_emitbuild"))
+        sc._emitparse = emitparse
+        sc._emitbuild = emitbuild
+
+    boundaries = set(id(sc) for sc in boundaries)
+    cut = []
+    visiting = set()
+    visited = set()
+
+    def visit(sc):
+        if id(sc) in visited:
+            return
+        visited.add(id(sc))
+
+        # LazyBound is mostly used for recursive structures too
+        if id(sc) in boundaries or isinstance(sc, LazyBound):
+            cut.append(sc)
+            return
+
+        for name, value in list(vars(sc).items()):
+            if name.startswith("_") or isinstance(value, (Construct, ExprMixin, type)):
+                continue
+            elif callable(value):
+                args = "obj_, list_, this" if isinstance(sc, (RepeatUntil, MyRepeatUntil)) else "this"
+                link(sc, name, value, args)
+            elif isinstance(sc, Computed) and name == "func":
+                if not isinstance(value, (int, float, str, bytes, type(None))):
+                    link(sc, name, value, None)
+
+        if isinstance(sc, Array):
+            patch_emits(sc, partial(_emitparse_array, sc), partial(_emitbuild_array, sc))
+        elif isinstance(sc, FocusedSeq) and "_emitparse" in vars(sc):
+            # PrefixedArray emits its own loop, without _index
+            patch_emits(sc, partial(FocusedSeq._emitparse, sc), partial(FocusedSeq._emitbuild, sc))
+        elif isinstance(sc, Adapter) and not isinstance(sc, CompilableAdapter):
+            if type(sc)._emitbuild is Construct._emitbuild:
+                # Hex only emits its parser, which returns a plain int
+                patch_emits(sc, partial(CompilableAdapter._emitparse, sc), partial(CompilableAdapter._emitbuild, sc))
+            else:
+                patch_emits(sc, sc._emitparse, partial(_emitbuild_adapter, sc._emitbuild))
+
+        visiting.add(id(sc))
+        for child in construct_children(sc):
+            if id(child) in visiting:
+                # recursive structure (through a shared dict of cases), the loop is cut on its way back
+                cut.append(sc)
+            else:
+                visit(child)
+        visiting.remove(id(sc))
+
+    try:
+        visit(subcon)
+        for sc in cut:
+            patch_emits(sc, _raise_not_implemented, _raise_not_implemented)
+
+        compiled = subcon.compile()
+        compiled.module.linkedexprs = linkedexprs
+        return compiled
+    finally:
+        for sc, name, value in patched_attrs:
+            setattr(sc, name, value)
+        for sc, emitparse, emitbuild in patched_emits.values():
+            del sc._emitparse
+            del sc._emitbuild
+            if emitparse is not None:
+                sc._emitparse = emitparse
+            if emitbuild is not None:
+                sc._emitbuild = emitbuild
@@ -210,3 +210,106 @@ class AdvancedItem:
         # app.exec()
 
         return generate_file(data)
+
+
+class ShapeFile:
+    """Shape.Gbx file (CPlugSurface) from a triangle mesh"""
+
+    def __init__(self, author="", name="", vertices=None, faces=None, gameplayId="No"):
+        self.author = author
+        self.name = name
+        self.vertices = vertices
+        self.faces = faces
+        self.gameplayId = EGameplay[gameplayId].nice_id
+
+    def generate(self):
+        data = new_file(
+            self.author,
+            self.name,
+            None,
+            new_body(new_surf_chunk(self.vertices, self.faces, gameplayId=self.gameplayId)),
+            List([None]),
+            classId=0x0900C000,
+        )
+        return generate_file(data)
+
+
+class MeshFile:
+    """Mesh.Gbx file (CPlugSolid2Model), meshes is a list of (positions, normals, uvs, faces, material_name)"""
+
+    def __init__(self, author="", name="", meshes=None):
+        self.author = author
+        self.name = name
+        self.meshes = meshes
+
+    def generate(self):
+        nodes = [None]
+        visuals_refidx = []
+        for positions, normals, uvs, faces, material_name in self.meshes:
+            visual_refidx = len(nodes)
+            visuals_refidx.append(visual_refidx)
+            # the vertex stream is stored right after its visual
+            nodes.append(new_visual_indexed_triangles(len(positions), visual_refidx + 1, faces))
+            nodes.append(new_vertex_stream(positions, normals, uvs))
+
+        data = new_file(
+            self.author,
+            self.name,
+            None,
+            new_body(new_solid2model_chunk(visuals_refidx, [mesh[-1] for mesh in self.meshes])),
+            List(nodes),
+            classId=0x090BB000,
+        )
+        return generate_file(data)
+
+
+class PrefabFile:
+    """Prefab.Gbx file (CPlugPrefab) of entities, like the entities of an AdvancedItem"""
+
+    def __init__(self, author="", name="", entities=None):
+        self.author = author
+        self.name = name
+        self.entities = entities
+
+    def generate(self):
+        nodes = [None]
+        files_refidx = {}
+        entities = []
+        for entity in self.entities:
+            entities += entity.get_entities(nodes, files_refidx)
+
+        data = new_file(
+            self.author,
+            self.name,
+            None,
+            new_composed_model(entities).body,
+            List(nodes),
+            classId=0x09145000,
+        )
+        return generate_file(data)
+
+
+class MapFile:
+    """Map.Gbx file (CGameCtnChallenge) with blocks as (name, (x, y, z)) and items as (item_name, (x, y, z))"""
+
+    def __init__(self, author="", name="", blocks=None, items=None):
+        self.author = author
+        self.name = name
+        self.blocks = blocks or []
+        self.items = items or []
+
+    def generate(self):
+        data = new_file(
+            self.author,
+            self.name,
+            None,
+            new_map_body(
+                self.author,
+                self.name,
+                [new_block(name, coords) for name, coords in self.blocks],
+                [new_anchored_object(item_name, self.author, pos) for item_name, pos in self.items],
+            ),
+            List([None]),
+            classId=0x03043000,
+        )
+        return generate_file(data)
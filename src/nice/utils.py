@@ -1,6 +1,7 @@
 import datetime
 import io
 
+import numpy as np
 from PIL import Image
 
 from construct import Container, ListContainer
@@ -119,12 +120,12 @@ def new_header(author, file_name, icon_filepath):
     )
 
 
-def new_file(author, file_name, icon_filepath, body, nodes):
+def new_file(author, file_name, icon_filepath, body, nodes, classId=0x2E002000):
     return Ctn(
         version=6,
         bodyCompression="compressed",
         u01_R_or_E=b"R",
-        classId=0x2E002000,
+        classId=classId,
         numNodes=0,
         header=new_header(author, file_name, icon_filepath),
         referenceTable=Ctn(numExternalNodes=0, externalFolders=None, externalNodes=List([])),
@@ -301,3 +302,247 @@ def get_refidx(nodes, files_refidx, filepath, extract_fn=extract_file, *params):
     else:
         files_refidx[filepath] = extract_fn(nodes, filepath, *params)
         return files_refidx[filepath]
+
+
+def new_surf_chunk(vertices, faces, physicsId="Concrete", gameplayId="No"):
+    """CPlugSurface mesh, vertices is a (N, 3) array, faces a (M, 3) array of vertex indices"""
+    return new_chunk(
+        0x0900C003,
+        Ctn(
+            version=4,
+            surfVersion=2,
+            surf=Ctn(
+                type="Mesh",
+                data=Ctn(
+                    version=7,
+                    vertices=List([Vec3(float(x), float(y), float(z)) for x, y, z in vertices]),
+                    triangles=List(
+                        [
+                            Ctn(
+                                face=Vec3(int(a), int(b), int(c)),
+                                materialId=Ctn(physicsId=physicsId, gameplayId=gameplayId),
+                                materialIndex=0,
+                            )
+                            for a, b, c in faces
+                        ]
+                    ),
+                ),
+                u01=Vec3(0, 0, 0),
+            ),
+            materials=List([]),
+            u01=None,
+            materialsIds=List([Ctn(physicsId=physicsId, gameplayId=gameplayId)]),
+            skel=-1,
+        ),
+    )
+
+
+def new_vertex_decl(name, space, type):
+    return Ctn(header=Ctn(u20=0, PtrOffset=0, u2=0, Space=space, Stride=0, Type=type, Name=name))
+
+
+def new_vertex_stream(positions, normals, uvs):
+    """CPlugVertexStream with positions, normals and uvs as (N, 3), (N, 3) and (N, 2) arrays"""
+    vec3 = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    dec3n = [("x", "<f8"), ("y", "<f8"), ("z", "<f8")]
+    vec2 = [("x", "<f4"), ("y", "<f4")]
+
+    return new_node(
+        0x09056000,
+        new_chunk(
+            0x09056000,
+            Ctn(
+                version=1,
+                num_vertices=len(positions),
+                u01=0,
+                baseVertexStream=-1,
+                DataDecl=List(
+                    [
+                        new_vertex_decl("Position", "Global3D", "Float3"),
+                        new_vertex_decl("Normal", "Local3D", "Float3"),
+                        new_vertex_decl("TexCoord0", "Global2D", "Float2"),
+                    ]
+                ),
+                compressFloat3InLocal3D=True,
+                Data=List(
+                    [
+                        np.rec.fromarrays(np.asarray(positions, dtype="<f4").T, dtype=vec3),
+                        np.rec.fromarrays(np.asarray(normals, dtype="<f8").T, dtype=dec3n),
+                        np.rec.fromarrays(np.asarray(uvs, dtype="<f4").T, dtype=vec2),
+                    ]
+                ),
+            ),
+        ),
+    )
+
+
+def new_visual_indexed_triangles(vertex_count, vertex_stream_refidx, faces):
+    """CPlugVisualIndexedTriangles using a vertex stream, faces are stored as relative indices"""
+    indices = np.asarray(faces, dtype=np.int64).reshape(-1)
+    relative_indices = np.diff(indices, prepend=0) % vertex_count
+
+    return new_node(
+        0x0906A000,
+        new_chunk(0x09006001, Ctn(u01=-1)),
+        new_chunk(0x09006004, Ctn(u01=-1)),
+        new_chunk(0x09006005, Ctn(sub_visuals=List([]))),
+        new_chunk(0x09006009, Ctn(**{"has_vertex_normals ": True})),
+        new_chunk(0x0900600B, Ctn(**{"splits ": List([])})),
+        new_chunk(
+            0x0900600F,
+            Ctn(
+                version=6,
+                ChunkFlags=Ctn(
+                    bit22=False,
+                    bit21=False,
+                    bit20=False,
+                    bit8=False,
+                    bit7=False,
+                    HasVertexNormals=True,
+                    isIndexationStaticBit=True,
+                    isGeometryStaticBit=True,
+                    SkinIndexCount=0,
+                ),
+                TexCoordCount=0,
+                VertexCount=vertex_count,
+                vertexStreams=List([vertex_stream_refidx]),
+                texCoords=List([]),
+                visualSkin=None,
+                u01=Ctn(x1=0, y1=0, z1=0, x2=0, y2=0, z2=0),
+                bitmapElemToPacks=List([]),
+                u02=List([]),
+                u03=0,
+                ByteCount=0,
+                u04=None,
+            ),
+        ),
+        new_chunk(0x09006010, Ctn(version=0, morph_count=0)),
+        new_chunk(0x0902C002, Ctn(u01=-1)),
+        new_chunk(
+            0x0906A001,
+            Ctn(
+                has_index_buffer=True,
+                index_buffer=new_body(new_chunk(0x09057000, Ctn(version=1, indices=relative_indices.astype("<u2")))),
+            ),
+        ),
+    )
+
+
+def new_solid2model_chunk(visuals_refidx, material_names):
+    """CPlugSolid2Model with one shaded geom per visual"""
+    return new_chunk(
+        0x090BB000,
+        Ctn(
+            version=6,
+            u01="",
+            shaded_geoms=List(
+                [
+                    Ctn(visual_index=i, material_index=i % len(material_names), u01=-1, lod=1)
+                    for i in range(len(visuals_refidx))
+                ]
+            ),
+            list_version_01=10,
+            visuals=List(visuals_refidx),
+            materials_names=List(material_names),
+            material_count=0,
+            list_version_02=10,
+            materials=List([]),
+            skel=-1,
+            lodDistances=List([]),
+            VisCstType="Static",
+            hasPreLightGen=False,
+            PreLightGen=None,
+            updatedTime=datetime.datetime.now(),
+            ImportString="",
+        ),
+    )
+
+
+def new_block(name, coords, dir="North"):
+    return Ctn(
+        name=name,
+        dir=dir,
+        coords=Vec3(*coords),
+        flags=Ctn(
+            u04=0,
+            isFree=False,
+            isGhost=False,
+            blockVariantIndex=0,
+            isWaypoint=False,
+            hasU05=False,
+            hasObsolete0=False,
+            hasU06=False,
+            u02a=False,
+            isSkinnable=False,
+            u01=False,
+            isClip=False,
+            isGround=False,
+            mobilVariantIndex=0,
+            mobilIndex=0,
+        ),
+        skinParams=None,
+        u05=None,
+        waypointParams=None,
+        obsolete0=None,
+        u06=None,
+    )
+
+
+def new_anchored_object(item_name, author, pos, rot=(0, 0, 0)):
+    return new_node(
+        0x03101000,
+        new_chunk(
+            0x03101002,
+            Ctn(
+                version=8,
+                itemModel=Ctn(id=item_name, collection="Stadium", author=author),
+                rotPitchYawRoll=Vec3(*rot),
+                blockUnitCoord=Vec3(int(pos[0] // 32), int(pos[1] // 8), int(pos[2] // 32)),
+                anchorTreeId="__default__",
+                absolutePositionInMap=Vec3(*pos),
+                waypointSpecialProperty=Ctn(classId=0xFFFFFFFF, body=None),
+                u03=None,
+                flags=0,
+                pivotPosition=Vec3(0, 0, 0),
+                scale=1.0,
+                packDesc=None,
+                u01=Vec3(0, 0, 0),
+                u02=Vec3(0, 0, 0),
+            ),
+        ),
+    )
+
+
+def new_map_body(author, map_name, blocks, anchored_objects):
+    return new_body(
+        new_chunk(
+            0x0304301F,
+            Ctn(
+                mapInfo=Ctn(id=map_name, collection="Stadium", author=author),
+                mapName=map_name,
+                decoration=Ctn(id="48x48Screen155Day", collection="Stadium", author="Nadeo"),
+                size=Vec3(48, 40, 48),
+                needUnlock=False,
+                version=6,
+                blocks=List(blocks),
+            ),
+        ),
+        new_chunk(0x03043022, Ctn(u01=1)),
+        new_chunk(0x03043025, Ctn(mapCoordOrigin=Ctn(x=0, y=0), mapCoordTarget=Ctn(x=0, y=0))),
+        new_chunk(
+            0x03043040,
+            Ctn(
+                version=7,
+                u01=0,
+                size=0,
+                _listVersion=10,
+                anchoredObjects=List(anchored_objects),
+                itemsOnItem=List([]),
+                blockIndexes=List([]),
+                snapItemGroups=List([]),
+                itemIndexes=List([]),
+                u07=List([]),
+                snappedIndexes=List([]),
+            ),
+        ),
+    )
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import construct
+
+import src.gbx_enums
+import src.gbx_structs
+import src.my_construct
+
+parser_version = None
+
+
+def get_parser_version():
+    """Changes whenever the structs or construct change, so stale entries are never reused."""
+    global parser_version
+    if parser_version is None:
+        h = hashlib.sha1(construct.version_string.encode())
+        for module in (src.gbx_structs, src.gbx_enums, src.my_construct):
+            with open(module.__file__, "rb") as f:
+                h.update(f.read())
+        parser_version = h.hexdigest()
+    return parser_version
+
+
+class DiskCache:
+    """Parsed trees stored on disk, addressed by the hash of the raw bytes.
+    Least recently used entries are removed once the folder grows over max_size bytes."""
+
+    def __init__(self, folder, max_size=2 * 1024**3):
+        self.folder = os.path.abspath(folder)
+        self.max_size = max_size
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    def key(self, raw_bytes):
+        h = hashlib.sha1(get_parser_version().encode())
+        h.update(raw_bytes)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], key + ".pickle")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except Exception:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # trees keeping live objects are parsed again each time
+            return False
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(raw)
+        if self.size > self.max_size:
+            self.evict()
+
+        return True
+
+    def entries(self):
+        for sub_folder in os.scandir(self.folder):
+            if not sub_folder.is_dir():
+                continue
+            for entry in os.scandir(sub_folder.path):
+                if entry.name.endswith(".pickle"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+
+        # free some room to not evict on every new entry
+        target_size = self.max_size * 0.9
+        for path, size, _ in entries:
+            if self.size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def clear(self):
+        for path, _, _ in list(self.entries()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.size = 0
+
+
+class NodeCache:
+    """In-memory LRU of parse_node_recursive results (data, nb_nodes, raw_bytes) by file path.
+    max_bytes bounds the summed size of the cached files, a proxy of the memory taken by their trees."""
+
+    def __init__(self, max_entries=None, max_bytes=None, keep_raw_bytes=True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.keep_raw_bytes = keep_raw_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, file_path):
+        return file_path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, file_path):
+        value, _ = self.entries[file_path]
+        self.entries.move_to_end(file_path)
+        return value
+
+    def __setitem__(self, file_path, value):
+        data, nb_nodes, raw_bytes = value
+        cost = len(raw_bytes)
+        if not self.keep_raw_bytes:
+            value = (data, nb_nodes, b"")
+
+        if file_path in self.entries:
+            self.size -= self.entries.pop(file_path)[1]
+        self.entries[file_path] = (value, cost)
+        self.size += cost
+
+        # the newest entry is always kept, even if it is over the budget by itself
+        while len(self.entries) > 1 and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries)
+            or (self.max_bytes is not None and self.size > self.max_bytes)
+        ):
+            _, (_, evicted_cost) = self.entries.popitem(last=False)
+            self.size -= evicted_cost
+
+    def get(self, file_path, default=None):
+        if file_path in self.entries:
+            self.hits += 1
+            return self[file_path]
+        self.misses += 1
+        return default
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
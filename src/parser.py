@@ -1,12 +1,91 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
-from construct import Container, ListContainer
+from construct import Container, ListContainer, ConstructError, Int32ul
 
-from src.gbx_structs import GbxStruct, GbxStructWithoutBodyParsed
+from src.gbx_structs import (
+    GbxStruct,
+    GbxStructWithoutBodyParsed,
+    GbxStructHeaderOnly,
+    LzoCompression,
+    set_lzo_compression,
+    use_compiled_body_chunks,
+)
+from src.parse_cache import DiskCache, NodeCache
+from runtime_params import parse_cache_dir, parse_cache_max_size_mb, compiled_parser, lzo_compression_level
 
+parse_cache = DiskCache(parse_cache_dir, parse_cache_max_size_mb * 1024**2) if parse_cache_dir else None
 
-def parse_node(file_path):
+if compiled_parser:
+    use_compiled_body_chunks()
+
+set_lzo_compression(LzoCompression(lzo_compression_level))
+
+
+def _parse_bytes(raw_bytes, file_path, lazy=False, profiler=None, incremental=False, columnar=False):
+    if profiler is not None:
+        # a cached tree would hide the parse from the profiler
+        profiler.enter("file", Int32ul.parse(raw_bytes[9:13]) if len(raw_bytes) >= 13 else None)
+        try:
+            return _parse_bytes_uncached(raw_bytes, file_path, lazy, profiler, incremental, columnar)
+        finally:
+            profiler.leave("parse", len(raw_bytes))
+    if incremental or columnar:
+        # cached trees have no raw chunks to copy back, nor tables
+        return _parse_bytes_uncached(raw_bytes, file_path, lazy, incremental=incremental, columnar=columnar)
+
+    key = None
+    if parse_cache is not None:
+        key = parse_cache.key(raw_bytes)
+        data = parse_cache.get(key)
+        if data is not None:
+            return data
+
+    data = _parse_bytes_uncached(raw_bytes, file_path, lazy)
+
+    # lazy trees still hold undecoded chunks, only full trees are worth storing
+    if key is not None and not lazy:
+        parse_cache.set(key, data)
+
+    return data
+
+
+def _parse_bytes_uncached(raw_bytes, file_path, lazy=False, profiler=None, incremental=False, columnar=False):
+    gbx_data = {}
+    # lazy chunks are decoded later against this same list
+    nodes = ListContainer()
+    data = GbxStruct.parse(
+        raw_bytes,
+        gbx_data=gbx_data,
+        nodes=nodes,
+        filename=file_path,
+        lazy=lazy,
+        profiler=profiler,
+        incremental=incremental,
+        columnar=columnar,
+    )
+    data.nodes = nodes
+    return data
+
+
+def _build_profiled(data, nodes, profiler, compression=None):
+    gbx_data = {}
+    if profiler is None:
+        return GbxStruct.build(data, gbx_data=gbx_data, nodes=nodes, profiler=None, compression=compression)
+
+    profiler.enter("file", data.get("classId", None))
+    new_bytes = b""
+    try:
+        new_bytes = GbxStruct.build(data, gbx_data=gbx_data, nodes=nodes, profiler=profiler, compression=compression)
+    finally:
+        profiler.leave("build", len(new_bytes))
+    return new_bytes
+
+
+def parse_node(file_path, lazy=False, profiler=None, incremental=False, columnar=False):
+    """With incremental=True, generate_node and generate_file copy back the raw bytes of the untouched chunks.
+    With columnar=True, the anchored objects of maps are parsed as a src.item_table.ItemTable."""
     file_path = os.path.abspath(file_path)
 
     if not os.path.exists(file_path):
@@ -20,11 +99,8 @@ def parse_node(file_path):
     with open(file_path, "rb") as f:
         raw_bytes = f.read()
 
-        gbx_data = {}
-        nodes = []
-        data = GbxStruct.parse(raw_bytes, gbx_data=gbx_data, nodes=nodes, filename=file_path)
+        data = _parse_bytes(raw_bytes, file_path, lazy, profiler, incremental, columnar)
         data.filepath = file_path
-        data.nodes = ListContainer(nodes)
         data.node_offset = 0
         nb_nodes = len(data.nodes) - 1
 
@@ -34,21 +110,115 @@ def parse_node(file_path):
 parse_file = parse_node
 
 
+def scan_node(file_path, read_size=4096):
+    """Parse the header and the reference table only, the body is never read nor decompressed.
+    Returns None if the file is not a valid gbx."""
+    file_path = os.path.abspath(file_path)
+
+    with open(file_path, "rb") as f:
+        raw_bytes = f.read(17)
+        if len(raw_bytes) < 17 or raw_bytes[:3] != b"GBX":
+            return None
+
+        # header chunks are prefixed by their total size, read them in one go
+        header_size = Int32ul.parse(raw_bytes[13:17])
+        raw_bytes += f.read(header_size + read_size)
+
+        while True:
+            try:
+                data = GbxStructHeaderOnly.parse(
+                    raw_bytes, gbx_data={}, nodes=ListContainer(), filename=file_path
+                )
+                break
+            except ConstructError:
+                # the reference table is truncated, read more
+                more_bytes = f.read(max(read_size, len(raw_bytes)))
+                if not more_bytes:
+                    return None
+                raw_bytes += more_bytes
+
+    data.filepath = file_path
+    return data
+
+
 def construct_all_folders(all_folders, parent_folder_path, current_folder):
     for folder in current_folder.folders:
         all_folders.append(os.path.normpath(parent_folder_path + folder.name) + os.path.sep)
         construct_all_folders(all_folders, all_folders[-1], folder)
 
 
-all_file_paths = {}
+def get_all_folders(data, file_path):
+    external_folders = data.referenceTable.externalFolders
+    root_folder_name = os.path.dirname(file_path) + os.path.sep
+    all_folders = [root_folder_name]
+    if external_folders is not None:
+        root_folder_name += (".." + os.path.sep) * external_folders.ancestorLevel
+        construct_all_folders(all_folders, root_folder_name, external_folders)
+
+    return all_folders
+
+
+def is_ignored_external_ref(ref):
+    if type(ref) is not str:
+        return True
+    elif not ref.endswith(".gbx") and not ref.endswith(".Gbx"):
+        return True
+    elif ref.endswith(".Texture.gbx"):
+        return True
+    elif ref.endswith(".Light.Gbx"):
+        return True
+    elif ref.endswith(".Sound.Gbx"):
+        return True
+    # elif ref.endswith(".PlaceParam.Gbx"):
+    #     return True
+    elif ref.endswith("VegetTreeModel.Gbx"):
+        return True
+    elif "Vegetation" in ref:
+        return True
+    return False
+
+
+def scan_dependencies(file_path, dependencies=None):
+    """Maps every file reachable through external nodes to the files it references, bodies are never parsed."""
+    if dependencies is None:
+        dependencies = {}
 
+    file_path = os.path.abspath(file_path)
+    if file_path in dependencies:
+        return dependencies
+    dependencies[file_path] = []
 
-def parse_node_recursive(file_path: Path, node_offset=0, path=None, flatten_nodes=False):
-    if file_path in all_file_paths:
-        print("reuse " + file_path)
-        return all_file_paths[file_path]
+    data = scan_node(file_path) if os.path.exists(file_path) else None
+    if data is None:
+        return dependencies
+
+    all_folders = get_all_folders(data, file_path)
+    for external_node in data.referenceTable.externalNodes:
+        if is_ignored_external_ref(external_node.ref) or external_node.ref.endswith(".Material.Gbx"):
+            continue
+        ext_node_filepath = os.path.abspath(all_folders[external_node.folderIndex] + external_node.ref)
+        dependencies[file_path].append(ext_node_filepath)
+        scan_dependencies(ext_node_filepath, dependencies)
+
+    return dependencies
+
+
+# unbounded by default, replace it or pass a bounded one for long batch runs
+all_file_paths = NodeCache()
+
+
+def parse_node_recursive(
+    file_path: Path, node_offset=0, path=None, flatten_nodes=False, lazy=False, cache=None, preparsed=None
+):
+    if cache is None:
+        cache = all_file_paths
 
     file_path = os.path.abspath(file_path)
+    cached = cache.get(file_path)
+    if cached is not None:
+        print("reuse " + file_path)
+        return cached
+
     if path is None:
         path = []
     depth = len(path)
@@ -66,42 +236,24 @@ def parse_node_recursive(file_path: Path, node_offset=0, path=None, flatten_node
     with open(file_path, "rb") as f:
         raw_bytes = f.read()
 
-        gbx_data = {}
-        nodes = []
-        data = GbxStruct.parse(raw_bytes, gbx_data=gbx_data, nodes=nodes, filename=file_path)
+        if preparsed is not None and file_path in preparsed:
+            data = preparsed.pop(file_path)
+        else:
+            data = _parse_bytes(raw_bytes, file_path, lazy)
         # for i, n in enumerate(nodes):
         #     if type(n) is Container:
         #         n.root_node = data
 
-        data.nodes = ListContainer(nodes)
         data.node_offset = node_offset
         data.path = path
         nb_nodes = len(data.nodes) - 1
         node_offset += len(data.nodes) - 1
 
-        # get all folders
-        external_folders = data.referenceTable.externalFolders
-        root_folder_name = os.path.dirname(file_path) + os.path.sep
-        all_folders = [root_folder_name]
-        if external_folders is not None:
-            root_folder_name += (".." + os.path.sep) * external_folders.ancestorLevel
-            construct_all_folders(all_folders, root_folder_name, external_folders)
+        all_folders = get_all_folders(data, file_path)
 
         # parse external nodes
         for external_node in data.referenceTable.externalNodes:
-            if not external_node.ref.endswith(".gbx") and not external_node.ref.endswith(".Gbx"):
-                continue
-            elif external_node.ref.endswith(".Texture.gbx"):
-                continue
-            elif external_node.ref.endswith(".Light.Gbx"):
-                continue
-            elif external_node.ref.endswith(".Sound.Gbx"):
-                continue
-            # elif external_node.ref.endswith(".PlaceParam.Gbx"):
-            #     continue
-            elif external_node.ref.endswith("VegetTreeModel.Gbx"):
-                continue
-            elif "Vegetation" in external_node.ref:
+            if is_ignored_external_ref(external_node.ref):
                 continue
             elif external_node.ref.endswith(".Material.Gbx"):
                 material_name = external_node.ref.split(".")[0]
@@ -126,6 +278,9 @@ def parse_node_recursive(file_path: Path, node_offset=0, path=None, flatten_node
                         node_offset,
                         path[:],
                         flatten_nodes,
+                        lazy,
+                        cache,
+                        preparsed,
                     )
                     nb_nodes += nb_sub_nodes
                     node_offset += nb_sub_nodes
@@ -138,11 +293,40 @@ def parse_node_recursive(file_path: Path, node_offset=0, path=None, flatten_node
             if n is not None and not "path" in n and type(n) is not str:
                 n.path = f"{path} [node={i}]"
 
-        all_file_paths[file_path] = (data, nb_nodes, raw_bytes)
-        return all_file_paths[file_path]
+        cache[file_path] = (data, nb_nodes, raw_bytes)
+        return cache[file_path]
+
+
+def _parse_file(file_path):
+    with open(file_path, "rb") as f:
+        return _parse_bytes(f.read(), file_path)
+
+
+def parse_node_recursive_parallel(file_path: Path, flatten_nodes=False, max_workers=None, cache=None):
+    """Same result as parse_node_recursive, but all the dependencies are first found with scan_node
+    and parsed in a process pool. Must be called under `if __name__ == "__main__"`."""
+    if cache is None:
+        cache = all_file_paths
 
+    dependencies = scan_dependencies(file_path)
+    to_parse = [dep for dep in dependencies if dep not in cache and os.path.exists(dep)]
 
-def generate_node(data, remove_external=True):
+    preparsed = {}
+    if len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(_parse_file, dep): dep for dep in to_parse}
+            for future in as_completed(futures):
+                try:
+                    preparsed[futures[future]] = future.result()
+                except Exception as e:
+                    # parsed again in this process while stitching
+                    print(f"[PARALLEL PARSE FAILED] {futures[future]} {e}")
+
+    return parse_node_recursive(file_path, flatten_nodes=flatten_nodes, cache=cache, preparsed=preparsed)
+
+
+def generate_node(data, remove_external=True, profiler=None, compression=None):
+    """compression is a LzoCompression (LZO_FAST, LZO_BEST), the one set with set_lzo_compression by default."""
     # compression
     data.header.body_compression = "compressed"
 
@@ -152,17 +336,15 @@ def generate_node(data, remove_external=True):
         data.referenceTable.externalFolders = None
         data.referenceTable.externalNodes = []
 
-    gbx_data = {}
     nodes = data.nodes[:]
-    new_bytes = GbxStruct.build(data, gbx_data=gbx_data, nodes=nodes)
+    new_bytes = _build_profiled(data, nodes, profiler, compression)
 
     return new_bytes
 
 
-def generate_file(data):
-    gbx_data = {}
+def generate_file(data, profiler=None, compression=None):
     nodes = data.nodes[:]
-    new_bytes = GbxStruct.build(data, gbx_data=gbx_data, nodes=nodes)
+    new_bytes = _build_profiled(data, nodes, profiler, compression)
 
     return new_bytes
 
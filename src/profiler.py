@@ -0,0 +1,131 @@
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+
+def format_id(id):
+    return "None" if id is None else f"0x{id:08X}"
+
+
+class Profiler:
+    """Time, bytes and allocated blocks of each file, node and chunk parsed or built with profiler=Profiler().
+
+    Times and allocations are inclusive (nested nodes and chunks are counted in their parent), self_time excludes
+    them. With trace_memory, tracemalloc also gives the peak memory of each frame but slows everything down.
+
+        profiler = Profiler()
+        data, nb_nodes, raw_bytes = parse_node(file_path, profiler=profiler)
+        profiler.report()
+        profiler.save_json("profile.json")
+        profiler.save_collapsed_stacks("profile.folded")  # flamegraph.pl profile.folded > profile.svg
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stats = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        self.stacks = defaultdict(float)
+        self.frames = []
+
+    def enter(self, kind, id):
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.frames:
+                self.frames[-1]["peak"] = max(self.frames[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+
+        self.frames.append(
+            {
+                "name": f"{kind} {format_id(id)}",
+                "kind": kind,
+                "id": id,
+                "memory": current,
+                "peak": current,
+                "children_time": 0.0,
+                "blocks": sys.getallocatedblocks(),
+                "start_time": time.perf_counter(),
+            }
+        )
+
+    def leave(self, operation, size):
+        elapsed = time.perf_counter() - self.frames[-1]["start_time"]
+        frame = self.frames.pop()
+        self_time = elapsed - frame["children_time"]
+
+        stats = self.stats[frame["kind"]][frame["id"]]
+        stats[f"{operation}_count"] += 1
+        stats[f"{operation}_bytes"] += size
+        stats[f"{operation}_time"] += elapsed
+        stats[f"{operation}_self_time"] += self_time
+        stats[f"{operation}_allocated_blocks"] += sys.getallocatedblocks() - frame["blocks"]
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            stats["peak_memory"] = max(stats["peak_memory"], peak - frame["memory"])
+            if self.frames:
+                self.frames[-1]["peak"] = max(self.frames[-1]["peak"], peak)
+
+        stack = ";".join([operation] + [parent["name"] for parent in self.frames] + [frame["name"]])
+        self.stacks[stack] += self_time
+
+        if self.frames:
+            self.frames[-1]["children_time"] += elapsed
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+
+    def stop(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def clear(self):
+        self.stats.clear()
+        self.stacks.clear()
+
+    def to_dict(self):
+        return {
+            kind: {format_id(id): dict(stats) for id, stats in ids.items()} for kind, ids in self.stats.items()
+        }
+
+    def save_json(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def collapsed_stacks(self):
+        """Folded stacks (one "frame;frame;frame count" per line) with the self time in microseconds,
+        as read by flamegraph.pl, speedscope or inferno"""
+        return "".join(f"{stack} {round(self_time * 1e6)}\n" for stack, self_time in sorted(self.stacks.items()))
+
+    def save_collapsed_stacks(self, file_path):
+        with open(file_path, "w") as f:
+            f.write(self.collapsed_stacks())
+
+    def hotspots(self, operation="parse", count=20):
+        """(kind, id, stats) with the longest self time"""
+        frames = [(kind, id, stats) for kind, ids in self.stats.items() for id, stats in ids.items()]
+        frames.sort(key=lambda frame: -frame[2][f"{operation}_self_time"])
+        return frames[:count]
+
+    def report(self, operation="parse", count=20):
+        print(
+            f"{'frame':<18}{'count':>7}{'KB':>10}{'total ms':>11}{'self ms':>10}{'blocks':>10}"
+            + (f"{'peak KB':>10}" if self.trace_memory else "")
+        )
+        for kind, id, stats in self.hotspots(operation, count):
+            print(
+                f"{kind + ' ' + format_id(id):<18}{int(stats[f'{operation}_count']):>7}"
+                f"{stats[f'{operation}_bytes'] / 1024:>10.1f}{stats[f'{operation}_time'] * 1000:>11.2f}"
+                f"{stats[f'{operation}_self_time'] * 1000:>10.2f}{int(stats[f'{operation}_allocated_blocks']):>10}"
+                + (f"{stats['peak_memory'] / 1024:>10.1f}" if self.trace_memory else "")
+            )
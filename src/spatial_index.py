@@ -0,0 +1,275 @@
+import heapq
+
+import numpy as np
+
+from src.block_table import BlockTable
+from src.item_table import ItemTable
+
+
+def coords_keys(coords):
+    """One int per block coords (bytes), in x, y, z order"""
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+    return (coords[:, 0] << 16) | (coords[:, 1] << 8) | coords[:, 2]
+
+
+def expand_ranges(starts, ends):
+    """Concatenation of the ranges starts[i]:ends[i], and the index i of each value"""
+    counts = ends - starts
+    owners = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return starts[owners] + offsets, owners
+
+
+class BlockGrid:
+    """Rows of a BlockTable by block coords: a uniform grid with one cell per block unit, stored as sorted keys."""
+
+    def __init__(self, table):
+        self.table = table
+        keys = coords_keys(table.coords)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def at(self, coords):
+        """Rows of the blocks at these coords"""
+        key = coords_keys(coords)[0]
+        return self.order[np.searchsorted(self.keys, key, "left") : np.searchsorted(self.keys, key, "right")]
+
+    def in_box(self, min_coords, max_coords):
+        """Rows of the blocks within the coords bounds, inclusive"""
+        lo = np.asarray(min_coords, dtype=np.int64)
+        hi = np.asarray(max_coords, dtype=np.int64)
+        if np.any(hi < np.maximum(lo, 0)) or np.any(lo > np.minimum(hi, 255)):
+            return np.zeros(0, dtype=np.int64)
+        lo = np.clip(lo, 0, 255)
+        hi = np.clip(hi, 0, 255)
+
+        # each (x, y) column of the box is one contiguous range of keys
+        xs, ys = np.meshgrid(np.arange(lo[0], hi[0] + 1), np.arange(lo[1], hi[1] + 1), indexing="ij")
+        columns = (xs.ravel() << 16) | (ys.ravel() << 8)
+        starts = np.searchsorted(self.keys, columns | lo[2], "left")
+        ends = np.searchsorted(self.keys, columns | hi[2], "right")
+        positions, _ = expand_ranges(starts, ends)
+        return np.sort(self.order[positions])
+
+    def nearest(self, coords, k=1):
+        """Rows of the k blocks nearest to coords (euclidean distance in block units), nearest first.
+        Cubes of growing size are searched until no block outside can be nearer."""
+        coords = np.asarray(coords, dtype=np.int64)
+        k = min(k, len(self.table))
+        radius = 0
+        while k > 0:
+            rows = self.in_box(coords - radius, coords + radius)
+            if len(rows) >= k:
+                distances = np.linalg.norm(self.table.coords[rows].astype(np.int64) - coords, axis=1)
+                nearest = np.argsort(distances, kind="stable")[:k]
+                # a block outside the cube is at least radius + 1 away
+                if distances[nearest[-1]] <= radius + 1 or radius > 255:
+                    return rows[nearest]
+            radius = max(1, radius * 2)
+        return np.zeros(0, dtype=np.int64)
+
+    def duplicates(self):
+        """Groups of rows of the blocks sharing the same coords"""
+        _, starts, counts = np.unique(self.keys, return_index=True, return_counts=True)
+        return [self.order[start : start + count] for start, count in zip(starts, counts) if count > 1]
+
+
+class ItemBVH:
+    """Bounding volume hierarchy over item positions (points), split at the median of the longest axis.
+    Nodes are stored in arrays, leaves keep a range of `order`."""
+
+    def __init__(self, positions, leaf_size=16):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.order = np.arange(len(self.positions))
+        self.lo = []
+        self.hi = []
+        self.children = []  # (left, right), or (-1, -1) for leaves
+        self.ranges = []  # (start, end) in order
+
+        if len(self.positions):
+            self.build(0, len(self.positions), leaf_size)
+        self.lo = np.array(self.lo).reshape(-1, 3)
+        self.hi = np.array(self.hi).reshape(-1, 3)
+
+    def build(self, start, end, leaf_size):
+        # explicit stack, maps can hold tens of thousands of items
+        node = self.add_node(start, end)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            start, end = self.ranges[node]
+            if end - start <= leaf_size:
+                continue
+
+            points = self.positions[self.order[start:end]]
+            axis = np.argmax(np.asarray(self.hi[node]) - np.asarray(self.lo[node]))
+            middle = (end - start) // 2
+            split = np.argpartition(points[:, axis], middle)
+            self.order[start:end] = self.order[start:end][split]
+
+            left = self.add_node(start, start + middle)
+            right = self.add_node(start + middle, end)
+            self.children[node] = (left, right)
+            stack.extend((left, right))
+
+    def add_node(self, start, end):
+        points = self.positions[self.order[start:end]]
+        self.lo.append(points.min(axis=0))
+        self.hi.append(points.max(axis=0))
+        self.children.append((-1, -1))
+        self.ranges.append((start, end))
+        return len(self.ranges) - 1
+
+    def in_box(self, min_position, max_position):
+        """Rows of the items within the bounds, inclusive"""
+        if not len(self.positions):
+            return np.zeros(0, dtype=np.int64)
+        min_position = np.asarray(min_position, dtype=np.float64)
+        max_position = np.asarray(max_position, dtype=np.float64)
+
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if np.any(self.hi[node] < min_position) or np.any(self.lo[node] > max_position):
+                continue
+            start, end = self.ranges[node]
+            rows = self.order[start:end]
+            if np.all(self.lo[node] >= min_position) and np.all(self.hi[node] <= max_position):
+                found.append(rows)
+            elif self.children[node][0] < 0:
+                points = self.positions[rows]
+                inside = np.all((points >= min_position) & (points <= max_position), axis=1)
+                found.append(rows[inside])
+            else:
+                stack.extend(self.children[node])
+
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def nearest(self, position, k=1):
+        """Rows of the k items nearest to position, nearest first"""
+        k = min(k, len(self.positions))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        position = np.asarray(position, dtype=np.float64)
+
+        def box_distance(node):
+            return np.linalg.norm(np.maximum(0, np.maximum(self.lo[node] - position, position - self.hi[node])))
+
+        best = []  # max heap of (-distance, row)
+        queue = [(box_distance(0), 0)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if len(best) == k and distance > -best[0][0]:
+                break
+            left, right = self.children[node]
+            if left >= 0:
+                heapq.heappush(queue, (box_distance(left), left))
+                heapq.heappush(queue, (box_distance(right), right))
+                continue
+
+            start, end = self.ranges[node]
+            rows = self.order[start:end]
+            for row, row_distance in zip(rows, np.linalg.norm(self.positions[rows] - position, axis=1)):
+                if len(best) < k:
+                    heapq.heappush(best, (-row_distance, row))
+                elif row_distance < -best[0][0]:
+                    heapq.heapreplace(best, (-row_distance, row))
+
+        return np.array([row for _, row in sorted(best, key=lambda entry: -entry[0])], dtype=np.int64)
+
+
+def close_pairs(positions, radius):
+    """(i, j) pairs with i < j of the points at most radius apart, sorted.
+    Points are hashed in cells of radius size, only the neighbouring cells are compared."""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    if len(positions) < 2 or radius <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    cells = np.floor(positions / radius).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    size = cells.max(axis=0) + 2
+    keys = (cells[:, 0] * size[1] + cells[:, 1]) * size[2] + cells[:, 2]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                neighbour_keys = ((cells[:, 0] + dx) * size[1] + cells[:, 1] + dy) * size[2] + cells[:, 2] + dz
+                starts = np.searchsorted(sorted_keys, neighbour_keys, "left")
+                ends = np.searchsorted(sorted_keys, neighbour_keys, "right")
+                positions_in_cells, owners = expand_ranges(starts, ends)
+                others = order[positions_in_cells]
+                keep = owners < others
+                owners, others = owners[keep], others[keep]
+                close = np.linalg.norm(positions[owners] - positions[others], axis=1) <= radius
+                pairs.append(np.stack([owners[close], others[close]], axis=1))
+
+    pairs = np.concatenate(pairs)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+class MapSpatialIndex:
+    """Blocks and items of a parsed map, to query them by position without walking all of them.
+
+    Blocks are in a uniform grid of block coords, items in a BVH over absolutePositionInMap. Queries return rows
+    of `blocks` (a BlockTable) and `items` (an ItemTable).
+
+        index = MapSpatialIndex.from_map(data)
+        rows = index.items_in_box((0, 0, 0), (64, 100, 64))
+        overlapping = index.item_collision_candidates(radius=1.0)
+    """
+
+    def __init__(self, blocks=None, items=None):
+        self.blocks = blocks
+        self.items = items
+        self.block_grid = BlockGrid(blocks) if blocks is not None else None
+        self.item_bvh = ItemBVH(items.items["absolutePositionInMap"]) if items is not None else None
+
+    @classmethod
+    def from_map(cls, data):
+        items = None
+        for chunk in data.body:
+            if chunk.chunkId == 0x03043040:
+                items = chunk.chunk.anchoredObjects
+                if not isinstance(items, ItemTable):
+                    items = ItemTable.from_anchored_objects(items)
+        return cls(BlockTable.from_map(data), items)
+
+    def blocks_at(self, coords):
+        return self.block_grid.at(coords)
+
+    def blocks_in_box(self, min_coords, max_coords):
+        return self.block_grid.in_box(min_coords, max_coords)
+
+    def nearest_blocks(self, coords, k=1):
+        return self.block_grid.nearest(coords, k)
+
+    def items_in_box(self, min_position, max_position):
+        return self.item_bvh.in_box(min_position, max_position)
+
+    def items_in_radius(self, position, radius):
+        position = np.asarray(position, dtype=np.float64)
+        rows = self.item_bvh.in_box(position - radius, position + radius)
+        distances = np.linalg.norm(self.item_bvh.positions[rows] - position, axis=1)
+        return rows[distances <= radius]
+
+    def nearest_items(self, position, k=1):
+        return self.item_bvh.nearest(position, k)
+
+    def block_collision_candidates(self):
+        """Groups of rows of the blocks at the same coords"""
+        return self.block_grid.duplicates()
+
+    def item_collision_candidates(self, radius):
+        """(i, j) rows of the items whose positions are at most radius apart"""
+        return close_pairs(self.item_bvh.positions, radius)
+
+    def blocks_near_items(self, rows=None, margin=0):
+        """For each item (all of them or the given rows), the rows of the blocks within margin block units of its
+        blockUnitCoord"""
+        rows = np.arange(len(self.items)) if rows is None else np.arange(len(self.items))[rows]
+        coords = self.items.items["blockUnitCoord"][rows].astype(np.int64)
+        return {int(row): self.block_grid.in_box(c - margin, c + margin) for row, c in zip(rows, coords)}
@@ -1,8 +1,9 @@
+import json
 import os
 
 from construct import Container, ListContainer
 
-from export_obj import export_ents, extract_meshes, export_obj, transform_final_pos
+from export_obj import export_ents, extract_meshes, export_obj, mesh_hash, transform_final_pos
 
 
 def extract_mobil(export_dir, file, data, mobil):
@@ -120,6 +121,31 @@ def extract_block_meshes(file, data):
                 )
 
 
+def mesh_paths_file(result):
+    return result["export_folder"] + "mesh_paths.json"
+
+
+def load_mesh_paths(result):
+    """Meshes deduped by extract_mobil2 in previous runs, files already extracted are not hashed again"""
+    try:
+        with open(mesh_paths_file(result)) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    result["mesh_paths"] = saved["mesh_paths"]
+    result["mesh_hashes"] = saved["mesh_hashes"]
+    paths_by_hash = result.setdefault("paths_by_hash", {})
+    for path, key in sorted(saved["mesh_hashes"].items()):
+        if saved["mesh_paths"].get(path) == path:
+            paths_by_hash.setdefault(key, path)
+
+
+def save_mesh_paths(result):
+    with open(mesh_paths_file(result), "w") as f:
+        json.dump({"mesh_paths": result.get("mesh_paths", {}), "mesh_hashes": result.get("mesh_hashes", {})}, f)
+
+
 def extract_mobil2(result, filename, data, mobil_model):
     mobil = {}
     for chunk in mobil_model.body:
@@ -138,21 +164,42 @@ def extract_mobil2(result, filename, data, mobil_model):
                 "meshes": [],
             }
 
+            # identical meshes of different files are exported once, in the folder of the first one
+            # (unless dedup_meshes is False, the batch driver dedups them once all the workers are done).
+            # load_mesh_paths and save_mesh_paths keep them across runs, already extracted files are not hashed
+            mesh_paths = result.setdefault("mesh_paths", {})  # file path: path of its exported meshes
+            mesh_hashes = result.setdefault("mesh_hashes", {})  # file path: mesh_hash of its meshes
+            paths_by_hash = result.setdefault("paths_by_hash", {})
+            dedup_meshes = result.get("dedup_meshes", True)
+
             for idx2, (filepath, meshes, all_pos, all_rot) in enumerate(all_meshes):
                 filepath = filepath.replace(result["base_folder"], "")
 
                 if meshes is not None:
-                    for idx, obj_params in enumerate(meshes):
-                        export_folder = result["export_folder"] + filepath + "\\"
-                        if not os.path.exists(export_folder):
-                            os.makedirs(export_folder)
-                        obj_filepath = (
-                            export_folder + f"mesh{idx}_lod{obj_params[-1]}.obj"
-                        )
-                        export_obj(obj_filepath, *obj_params, blender_space=True)
+                    key = mesh_hash(meshes)
+                    mesh_hashes[filepath] = key
+                    kept_path = paths_by_hash.get(key)
+                    if (
+                        dedup_meshes
+                        and kept_path is not None
+                        and os.path.isdir(result["export_folder"] + kept_path + "\\")
+                    ):
+                        mesh_paths[filepath] = kept_path
+                    else:
+                        paths_by_hash[key] = mesh_paths[filepath] = filepath
+                        for idx, obj_params in enumerate(meshes):
+                            export_folder = result["export_folder"] + filepath + "\\"
+                            if not os.path.exists(export_folder):
+                                os.makedirs(export_folder, exist_ok=True)
+                            obj_filepath = (
+                                export_folder + f"mesh{idx}_lod{obj_params[-1]}.obj"
+                            )
+                            export_obj(obj_filepath, *obj_params, blender_space=True)
 
                 pos, quat = transform_final_pos(all_pos, all_rot)
-                mobil["meshes"].append({"path": filepath, "pos": pos, "rot": quat})
+                mobil["meshes"].append(
+                    {"path": mesh_paths.get(filepath, filepath), "pos": pos, "rot": quat}
+                )
 
     return mobil
 